@@ -1,15 +1,29 @@
 from datetime import date, timedelta
+from functools import partial
 
 import folium
 import pandas as pd
 import streamlit as st
+from folium.plugins import VectorGridProtobuf
 from src import hf_utils
 from src.config_parameters import params
-from src.gfm import get_cached_aois, get_cached_gfm_handler
+from src.flood_composite import get_flood_composite
+from src.flood_stats import get_time_group_flood_stats
+from src.gfm import (
+    get_cached_aois,
+    get_cached_gfm_handler,
+    group_products_by_time,
+)
+from src.ingest_queue import DONE, FAILED, get_cached_ingest_queue
+from src.merged_layers import get_cached_merged_layer_cache
+from src.metrics import span
+from src.product_listing_cache import get_cached_product_listing_cache
+from src.simplify import choose_simplify_tolerance
+from src.vector_tiles import get_cached_tile_server, tile_url
 from src.utils import (
     add_about,
+    get_aoi_bounds,
     get_aoi_id_from_selector_preview,
-    get_existing_geojson,
     set_tool_page_style,
     toggle_menu_button,
 )
@@ -46,14 +60,14 @@ gfm = get_cached_gfm_handler()
 aois = get_cached_aois()
 
 
-if "all_products" not in st.session_state:
-    st.session_state["all_products"] = None
+if "product_groups" not in st.session_state:
+    st.session_state["product_groups"] = None
 
 
 # To force removing product checkboxes when AOI selector changes
 def on_area_selector_change():
     print("Area selector changed, removing product checkboxes")
-    st.session_state["all_products"] = None
+    st.session_state["product_groups"] = None
 
 
 # Contains AOI selector
@@ -87,12 +101,37 @@ with col4:
     """,
     )
     show_available_products = st.button("Show available products")
+    refresh_product_listing = st.checkbox(
+        "Refresh from GFM",
+        help="Query GFM again for the whole date range instead of using earlier results",
+    )
 
 # If button above is triggered, get products from GFM
-# Then save all products to the session state and rerun the app to display them
+# Only date ranges not in the listing cache are queried, in windows,
+# found time groups are shown while the remaining windows load
+# Then save all products grouped by time group to the session state and rerun the app to display them
 if show_available_products:
-    products = gfm.get_area_products(selected_area_id, start_date, end_date)
-    st.session_state["all_products"] = products
+    if refresh_product_listing:
+        get_cached_product_listing_cache().invalidate(selected_area_id)
+    products = []
+    with col2_2:
+        found_products_placeholder = st.empty()
+    with st.spinner("Getting available products from GFM"):
+        for window_products in get_cached_product_listing_cache().iter_products(
+            gfm,
+            selected_area_id,
+            start_date,
+            end_date,
+            window_days=params["product_query_window_days"],
+        ):
+            products.extend(window_products)
+            found_products_placeholder.dataframe(
+                pd.DataFrame(
+                    {"Product Time Group": list(group_products_by_time(products))}
+                ),
+                hide_index=True,
+            )
+    st.session_state["product_groups"] = group_products_by_time(products)
     st.rerun()
 
 # Contains the product checkboxes if they exist after pushing the "Show available products" button
@@ -103,31 +142,18 @@ with col2_2:
 with row_checkboxes:
     checkboxes = list()
     # Products are checked against the index to check whether they are already downloaded
-    index_df = hf_utils.get_geojson_index_df()
-    if st.session_state["all_products"]:
-        # Get unique product time groups
-        unique_time_groups = set()
-        for product in st.session_state["all_products"]:
-            unique_time_groups.add(product["product_time_group"])
-
+    geojson_index = hf_utils.get_geojson_index()
+    if st.session_state["product_groups"]:
         # Create dataframe for the table
         product_data = []
-        for time_group in sorted(unique_time_groups):
+        for time_group, products_in_group in st.session_state["product_groups"].items():
             # Check if any product in this group is already downloaded
-            products_in_group = [
-                p
-                for p in st.session_state["all_products"]
-                if p["product_time_group"] == time_group
-            ]
-
             dataset_link = ""
             for product in products_in_group:
-                if product["product_id"] in index_df["product"].values:
+                index_row = geojson_index.get(product["product_id"])
+                if index_row is not None:
                     available_status = "Available in Floodmap"
-                    flood_geojson_path = index_df.loc[
-                        index_df["product"] == product["product_id"],
-                        "flood_geojson_path",
-                    ].values[0]
+                    flood_geojson_path = index_row["flood_geojson_path"]
                     dataset_link = f"https://huggingface.co/datasets/rodekruis/flood-mapping/resolve/main/{flood_geojson_path}?download=true"
 
             product_data.append(
@@ -161,12 +187,62 @@ with row_checkboxes:
         # Convert checkbox states to list for compatibility with existing code
         checkboxes = product_groups_st_df["Check"].tolist()
 
+        # Flooded area within the AOI of the selected time groups that are in the dataset
+        stats_data = []
+        for checkbox, (time_group, products_in_group) in zip(
+            checkboxes, st.session_state["product_groups"].items()
+        ):
+            if not checkbox:
+                continue
+            available_product_ids = tuple(
+                product["product_id"]
+                for product in products_in_group
+                if product["product_id"] in geojson_index
+            )
+            if not available_product_ids:
+                continue
+            stats = get_time_group_flood_stats(
+                selected_area_id, time_group, available_product_ids
+            )
+            stats_data.append({"Product time": time_group, **stats})
+
+        if stats_data:
+            st.dataframe(
+                pd.DataFrame(stats_data),
+                column_config={
+                    "Product time": "Product Time Group",
+                    "flooded_km2": st.column_config.NumberColumn(
+                        "Flooded (km²)", format="%.2f"
+                    ),
+                    "observed_km2": st.column_config.NumberColumn(
+                        "Observed (km²)",
+                        help="Part of the area of interest covered by the Sentinel footprint",
+                        format="%.2f",
+                    ),
+                    "flooded_percentage": st.column_config.NumberColumn(
+                        "Flooded (% of observed)", format="%.1f"
+                    ),
+                },
+                hide_index=True,
+            )
+
 with row_buttons:
     below_checkbox_col1, below_checkbox_col2 = row_buttons.columns([1, 1])
 
+# Contains the composite toggle
+with below_checkbox_col2:
+    composite_mode = st.toggle(
+        "Flood frequency composite",
+        help="""
+        Show how often each location was flooded between the start and end date,
+        out of the times it was observed, for all products in the dataset for this AOI,
+        instead of the selected time groups.
+        """,
+    )
+
 # Contains the "Download Products" button
 with below_checkbox_col1:
-    if st.session_state["all_products"]:
+    if st.session_state["product_groups"]:
         st.text(
             "Button info",
             help=""
@@ -179,98 +255,197 @@ with below_checkbox_col1:
         )
         download_products = st.button("Download product to tool")
 
+        if st.session_state.get("failed_downloads"):
+            st.error(
+                "Failed to download products for: "
+                + ", ".join(st.session_state["failed_downloads"])
+            )
+            st.session_state["failed_downloads"] = []
+
         # If the button is clicked download all checked products that have not been downloaded yet
         if download_products:
-            index_df = hf_utils.get_geojson_index_df()
+            geojson_index = hf_utils.get_geojson_index()
             # Get selected time groups from the table
             selected_time_groups = product_groups_st_df[product_groups_st_df["Check"]][
                 "Product time"
             ].tolist()
 
-            # For each selected time group
-            for time_group in selected_time_groups:
-                # Get all products for this time group
-                products_in_group = [
-                    p
-                    for p in st.session_state["all_products"]
-                    if p["product_time_group"] == time_group
+            # Collect all products in the selected time groups that haven't been downloaded yet
+            products_to_download = [
+                p
+                for time_group in selected_time_groups
+                for p in st.session_state["product_groups"][time_group]
+                if p["product_id"] not in geojson_index
+            ]
+
+            # Downloads run in the background, so they continue when the page is left
+            ingest_queue = get_cached_ingest_queue()
+            for product in products_to_download:
+                ingest_queue.submit(selected_area_id, product)
+            st.session_state["ingest_product_ids"] = [
+                p["product_id"] for p in products_to_download
+            ]
+
+        # Poll the status of submitted downloads until all are finished
+        if st.session_state.get("ingest_product_ids"):
+
+            @st.fragment(run_every=2)
+            def show_ingest_progress():
+                jobs = get_cached_ingest_queue().status(
+                    st.session_state["ingest_product_ids"]
+                )
+                n_total = len(st.session_state["ingest_product_ids"])
+                n_finished = sum(
+                    job["status"] in (DONE, FAILED) for job in jobs.values()
+                )
+                if n_finished < n_total:
+                    st.progress(
+                        n_finished / n_total,
+                        text=f"Getting GFM files, processed {n_finished}/{n_total} products",
+                    )
+                    return
+
+                # Keep failed products in the session state so they can be shown after the rerun
+                st.session_state["failed_downloads"] = [
+                    job["product"]["product_time"]
+                    for job in jobs.values()
+                    if job["status"] == FAILED
                 ]
+                st.session_state["ingest_product_ids"] = []
+                st.rerun()
 
-                # Download each product in the group that hasn't been downloaded yet
-                for product_to_download in products_in_group:
-                    if (
-                        product_to_download["product_id"]
-                        not in index_df["product"].values
-                    ):
-                        with st.spinner(
-                            f"Getting GFM files for {product_to_download['product_time']}, this may take a couple of minutes"
-                        ):
-                            gfm.download_flood_product(
-                                selected_area_id, product_to_download
-                            )
-            st.rerun()
+            show_ingest_progress()
 
 # For all the selected products add them to the map if they are available
 feature_groups = []
+tile_layers = []
 flood_featuregroup = None
 selected_geojsons = []
-if st.session_state["all_products"]:
-    index_df = hf_utils.get_geojson_index_df()
-    # Get unique time groups
-    unique_time_groups = sorted(
-        set(p["product_time_group"] for p in st.session_state["all_products"])
-    )
-
-    # For each checkbox (which corresponds to a time group)
-    for i, checkbox in enumerate(checkboxes):
-        if checkbox:
-            time_group = unique_time_groups[i]
-            # Get all products for this time group
-            products_in_group = [
-                p
-                for p in st.session_state["all_products"]
-                if p["product_time_group"] == time_group
-            ]
-
-            # Create a feature group for this time group
-            flood_featuregroup = folium.FeatureGroup(name=time_group)
-            footprint_featuregroup = folium.FeatureGroup(name="Sentinel footprint")
-            group_has_features = False
-
-            # Add all available products from this group to the feature group
-            for product in products_in_group:
-                if product["product_id"] in index_df["product"].values:
-                    # Get the raw geojsons for further usage in the app
-                    flood_geojson = get_existing_geojson(product["product_id"], "flood")
-                    selected_geojsons.append(flood_geojson)
-                    # Convert geojsons to folium features to display on the map
-                    flood_folium_geojson = folium.GeoJson(
-                        flood_geojson,
-                        style_function=lambda x: {
-                            "fillColor": "#ff0000",
-                            "color": "#ff0000",
-                            "fillOpacity": 0.2,
-                        },
-                    )
-                    flood_featuregroup.add_child(flood_folium_geojson)
+# Time spent building the layers is recorded, see src/metrics.py
+with span("build_map_layers"):
+    flood_composite = None
+    if composite_mode:
+        with st.spinner("Computing flood frequency composite"):
+            flood_composite = get_flood_composite(
+                selected_area_id, start_date, end_date
+            )
+        if flood_composite:
+            composite_featuregroup = folium.FeatureGroup(name="Flood frequency")
+            composite_featuregroup.add_child(
+                folium.raster_layers.ImageOverlay(
+                    flood_composite["image_url"], bounds=flood_composite["bounds"]
+                )
+            )
+            feature_groups.append(composite_featuregroup)
+        else:
+            st.warning("No products in the dataset for this AOI and date range")
+    elif st.session_state["product_groups"]:
+        geojson_index = hf_utils.get_geojson_index()
+        # Flood geometries are simplified to what is visible at the extent of the AOI
+        flood_tolerance = choose_simplify_tolerance(aois[selected_area_id]["bbox"])
+        # Only the parts of products that intersect the AOI are read
+        aoi_bounds = get_aoi_bounds(aois[selected_area_id])
+        # The products of a time group are shown as one merged flood and footprint layer
+        merged_layer_cache = get_cached_merged_layer_cache()
+        # Flood layers are served as vector tiles when the tile server is running
+        tile_server = (
+            get_cached_tile_server() if params["vector_tiles_enabled"] else None
+        )
 
-                    footprint_geojson = get_existing_geojson(
-                        product["product_id"], "footprint"
+        # For each checkbox (which corresponds to a time group)
+        for checkbox, (time_group, products_in_group) in zip(
+            checkboxes, st.session_state["product_groups"].items()
+        ):
+            if checkbox:
+                available_product_ids = [
+                    product["product_id"]
+                    for product in products_in_group
+                    if product["product_id"] in geojson_index
+                ]
+                if not available_product_ids:
+                    continue
+
+                # Only the tiles in view are loaded
+                if tile_server:
+                    tileset_key = tile_server.register(
+                        "/".join([selected_area_id, *available_product_ids]),
+                        partial(
+                            merged_layer_cache.get_layers,
+                            selected_area_id,
+                            time_group,
+                            available_product_ids,
+                            aoi_bounds,
+                        ),
                     )
-                    footprint_folium_geojson = folium.GeoJson(
-                        footprint_geojson,
-                        style_function=lambda x: {
-                            "fillColor": "yellow",
-                            "color": "yellow",
-                            "fillOpacity": 0.2,
-                            "weight": 0,
-                        },
+                    tile_layers.append(
+                        VectorGridProtobuf(
+                            tile_url(tileset_key),
+                            name=time_group,
+                            options={
+                                "vectorTileLayerStyles": {
+                                    "flood": {
+                                        "fill": True,
+                                        "fillColor": "#ff0000",
+                                        "color": "#ff0000",
+                                        "fillOpacity": 0.2,
+                                        "weight": 1,
+                                    },
+                                    "footprint": {
+                                        "fill": True,
+                                        "fillColor": "yellow",
+                                        "color": "yellow",
+                                        "fillOpacity": 0.2,
+                                        "weight": 0,
+                                    },
+                                }
+                            },
+                        )
                     )
-                    footprint_featuregroup.add_child(footprint_folium_geojson)
-                    group_has_features = True
+                    continue
+
+                # Create a feature group for this time group
+                flood_featuregroup = folium.FeatureGroup(name=time_group)
+                footprint_featuregroup = folium.FeatureGroup(name="Sentinel footprint")
+
+                # Get the merged geojsons for further usage in the app
+                flood_geojson = merged_layer_cache.get_geojson(
+                    selected_area_id,
+                    time_group,
+                    "flood",
+                    available_product_ids,
+                    aoi_bounds,
+                    flood_tolerance,
+                )
+                selected_geojsons.append(flood_geojson)
+                # Convert geojsons to folium features to display on the map
+                flood_folium_geojson = folium.GeoJson(
+                    flood_geojson,
+                    style_function=lambda x: {
+                        "fillColor": "#ff0000",
+                        "color": "#ff0000",
+                        "fillOpacity": 0.2,
+                    },
+                )
+                flood_featuregroup.add_child(flood_folium_geojson)
+
+                footprint_geojson = merged_layer_cache.get_geojson(
+                    selected_area_id,
+                    time_group,
+                    "footprint",
+                    available_product_ids,
+                    aoi_bounds,
+                )
+                footprint_folium_geojson = folium.GeoJson(
+                    footprint_geojson,
+                    style_function=lambda x: {
+                        "fillColor": "yellow",
+                        "color": "yellow",
+                        "fillOpacity": 0.2,
+                        "weight": 0,
+                    },
+                )
+                footprint_featuregroup.add_child(footprint_folium_geojson)
 
-            # Only add the feature group if it contains any features
-            if group_has_features:
                 feature_groups.append(flood_featuregroup)
                 feature_groups.append(footprint_featuregroup)
 
@@ -290,12 +465,23 @@ with col2_1:
     # Create folium map
     folium_map = folium.Map([39, 0], zoom_start=8)
     folium_map.fit_bounds(feat_group_selected_area.get_bounds())
+    for tile_layer in tile_layers:
+        tile_layer.add_to(folium_map)
 
-    m = st_folium(
-        folium_map, width=800, height=450, feature_group_to_add=feature_groups
-    )
+    # Serialises the map and its layers to html
+    with span("render_map"):
+        m = st_folium(
+            folium_map, width=800, height=450, feature_group_to_add=feature_groups
+        )
 
-    if flood_featuregroup:
+    if flood_composite:
+        flood_part_of_legend = f"""
+        <div style="display: flex; align-items: center;">
+            <div style="width: 60px; height: 20px; background: linear-gradient(to right, rgba(158, 202, 225, .8), rgba(8, 48, 107, .9));"></div>
+            <div style="margin-left: 5px;">Flooded share of observations ({flood_composite["time_groups"]} time groups)</div>
+        </div>
+        """
+    elif flood_featuregroup or tile_layers:
         flood_part_of_legend = """
         <div style="display: flex; align-items: center;">
             <div style="width: 20px; height: 20px; background:  rgba(255, 0, 0, .2); border: 1px solid red;"></div>
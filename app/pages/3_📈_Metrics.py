@@ -0,0 +1,125 @@
+# """Admin page with the timings and byte counts recorded by src/metrics.py."""
+
+import pandas as pd
+import streamlit as st
+from src.config_parameters import params
+from src.metrics import DURATION_BUCKETS, registry
+from src.product_cache import get_cached_product_cache
+from src.utils import (
+    add_about,
+    set_tool_page_style,
+    toggle_menu_button,
+)
+
+# Page configuration
+st.set_page_config(layout="wide", page_title=params["browser_title"])
+
+# If app is deployed hide menu button
+toggle_menu_button()
+
+# Create sidebar
+add_about()
+
+# Set page style
+set_tool_page_style()
+
+# Page title
+st.markdown("# Metrics")
+
+if not params["metrics_enabled"]:
+    st.info("Metrics are disabled, set metrics_enabled=true in the environment.")
+    st.stop()
+
+
+def _approximate_percentile(buckets, count, q):
+    """Upper bound of the histogram bucket that contains the q-th percentile"""
+    rank = q / 100 * count
+    cumulative = 0
+    for upper_bound, bucket_count in zip([*DURATION_BUCKETS, float("inf")], buckets):
+        cumulative += bucket_count
+        if cumulative >= rank:
+            return upper_bound
+    return float("inf")
+
+
+durations, byte_counts = registry.snapshot()
+
+st.markdown("## Timings")
+st.dataframe(
+    pd.DataFrame(
+        [
+            {
+                "Name": name,
+                "Labels": ", ".join(f"{k}={v}" for k, v in labels),
+                "Count": histogram["count"],
+                "Total (s)": histogram["sum"],
+                "Mean (ms)": 1000 * histogram["sum"] / histogram["count"],
+                "p95 below (s)": _approximate_percentile(
+                    histogram["buckets"], histogram["count"], 95
+                ),
+            }
+            for (name, labels), histogram in sorted(durations.items())
+        ],
+        columns=["Name", "Labels", "Count", "Total (s)", "Mean (ms)", "p95 below (s)"],
+    ),
+    hide_index=True,
+)
+
+st.markdown("## Bytes")
+st.dataframe(
+    pd.DataFrame(
+        [
+            {
+                "Name": name,
+                "Labels": ", ".join(f"{k}={v}" for k, v in labels),
+                "MB": n_bytes / 1024 / 1024,
+            }
+            for (name, labels), n_bytes in sorted(byte_counts.items())
+        ],
+        columns=["Name", "Labels", "MB"],
+    ),
+    hide_index=True,
+)
+
+st.markdown("## Product cache")
+product_cache = get_cached_product_cache()
+product_cache_stats = product_cache.stats()
+st.dataframe(
+    pd.DataFrame(
+        [
+            {
+                "Level": "Memory",
+                "Hits": product_cache_stats["memory_hits"],
+                "Evictions": product_cache_stats["memory_evictions"],
+                "MB": product_cache_stats["memory_bytes"] / 1024 / 1024,
+                "Limit (MB)": product_cache.max_memory_bytes / 1024 / 1024,
+            },
+            {
+                "Level": "Disk",
+                "Hits": product_cache_stats["disk_hits"],
+                "Evictions": product_cache_stats["disk_evictions"],
+                "MB": product_cache_stats["disk_bytes"] / 1024 / 1024,
+                "Limit (MB)": product_cache.max_disk_bytes / 1024 / 1024,
+            },
+        ]
+    ),
+    hide_index=True,
+)
+st.markdown(
+    f"{product_cache_stats['misses']} misses, fetched from the dataset. "
+    f"{product_cache_stats['memory_entries']} parsed geojsons in memory, "
+    "their size is estimated."
+)
+
+col1, col2 = st.columns([1, 1])
+with col1:
+    st.download_button(
+        "Download in Prometheus format",
+        registry.to_prometheus(),
+        file_name="floodmap_metrics.prom",
+        mime="text/plain",
+    )
+with col2:
+    if st.button("Reset metrics"):
+        registry.reset()
+        st.rerun()
@@ -0,0 +1,158 @@
+"""
+Command line backfill of the dataset with the GFM products of all AOIs over a date range,
+without the Streamlit app. Run from the repository root, e.g.:
+
+    PYTHONPATH=app python -m src.backfill --from 2025-01-01 --to 2025-02-01
+
+Products that are already in the index are skipped and products are committed in batches,
+so an interrupted backfill continues where it stopped when it is started again.
+AOIs that were completed for the same date range are recorded in a state file and skipped.
+"""
+
+import argparse
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date
+from pathlib import Path
+
+from src import hf_utils
+from src.config_parameters import params
+from src.gfm import get_cached_gfm_handler
+
+
+class BackfillState:
+    """AOIs completed per date range, stored as json so they survive restarts"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        if self.path.exists():
+            self._completed = set(json.loads(self.path.read_text())["completed"])
+        else:
+            self._completed = set()
+
+    @staticmethod
+    def _key(area_id, from_date, to_date):
+        return f"{area_id}/{from_date}/{to_date}"
+
+    def is_completed(self, area_id, from_date, to_date):
+        return self._key(area_id, from_date, to_date) in self._completed
+
+    def mark_completed(self, area_id, from_date, to_date):
+        with self._lock:
+            self._completed.add(self._key(area_id, from_date, to_date))
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(".tmp")
+            tmp_path.write_text(json.dumps({"completed": sorted(self._completed)}))
+            os.replace(tmp_path, self.path)
+
+
+def backfill_aoi(gfm, area_id, from_date, to_date, batch_size, download_workers):
+    """Download all products of the AOI in the date range that are not in the index yet"""
+    products = []
+    for window_products in gfm.iter_area_products(
+        area_id, from_date, to_date, window_days=params["product_query_window_days"]
+    ):
+        products.extend(window_products)
+
+    # The index is updated after every commit, also by other AOIs being backfilled
+    geojson_index = hf_utils.get_geojson_index()
+    products = [p for p in products if p["product_id"] not in geojson_index]
+    print(f"AOI {area_id}: {len(products)} products to download")
+
+    errors = {}
+    for start in range(0, len(products), batch_size):
+        batch = products[start : start + batch_size]
+        batch_errors = gfm.download_flood_products(
+            area_id, batch, max_workers=download_workers
+        )
+        errors.update({k: v for k, v in batch_errors.items() if v is not None})
+        print(
+            f"AOI {area_id}: committed {min(start + batch_size, len(products))}"
+            f"/{len(products)} products"
+        )
+    return errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Download the GFM products of AOIs over a date range to the dataset"
+    )
+    parser.add_argument(
+        "--from",
+        dest="from_date",
+        type=date.fromisoformat,
+        required=True,
+        help="Start of the date range, as YYYY-MM-DD",
+    )
+    parser.add_argument(
+        "--to",
+        dest="to_date",
+        type=date.fromisoformat,
+        required=True,
+        help="End of the date range, up to the start of this day",
+    )
+    parser.add_argument(
+        "--aoi", action="append", help="Only backfill this AOI id, can be repeated"
+    )
+    parser.add_argument(
+        "--aoi-workers", type=int, default=2, help="AOIs backfilled concurrently"
+    )
+    parser.add_argument(
+        "--download-workers",
+        type=int,
+        default=4,
+        help="Concurrent product downloads per AOI",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=20, help="Products per dataset commit"
+    )
+    parser.add_argument("--state-file", default=".cache/backfill_state.json")
+    args = parser.parse_args(argv)
+
+    gfm = get_cached_gfm_handler()
+    area_ids = args.aoi or list(gfm.retrieve_all_aois())
+    state = BackfillState(args.state_file)
+    area_ids = [
+        area_id
+        for area_id in area_ids
+        if not state.is_completed(area_id, args.from_date, args.to_date)
+    ]
+    print(f"Backfilling {len(area_ids)} AOIs from {args.from_date} to {args.to_date}")
+
+    failed = {}
+    with ThreadPoolExecutor(max_workers=args.aoi_workers) as executor:
+        futures = {
+            executor.submit(
+                backfill_aoi,
+                gfm,
+                area_id,
+                args.from_date,
+                args.to_date,
+                args.batch_size,
+                args.download_workers,
+            ): area_id
+            for area_id in area_ids
+        }
+        for future in as_completed(futures):
+            area_id = futures[future]
+            try:
+                errors = future.result()
+            except Exception as e:
+                print(f"AOI {area_id} failed: {e}")
+                failed[area_id] = e
+                continue
+            if errors:
+                failed.update(errors)
+            else:
+                state.mark_completed(area_id, args.from_date, args.to_date)
+
+    for key, error in failed.items():
+        print(f"Failed: {key}: {error}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
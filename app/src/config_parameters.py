@@ -1,5 +1,7 @@
 """Configuration file."""
 
+import os
+
 params = {
     # Title browser tab
     "browser_title": "Flood mapping tool - 510",
@@ -35,4 +37,71 @@ params = {
     "button_text_fontsize": "24px",
     "button_text_fontweight": "bold",
     "button_background_color": "#dae7f4",
+    # GFM API
+    ## Can point to a local stand-in of the API, e.g. for tests
+    "gfm_base_url": os.environ.get("gfm_base_url", "https://api.gfm.eodc.eu/v1"),
+    ## Requests are spaced out to stay within the rate limits of the API
+    "gfm_max_requests_per_second": 5,
+    ## Connection pool, timeouts in seconds and retries with exponential backoff
+    "gfm_pool_size": 10,
+    "gfm_connect_timeout": 5,
+    "gfm_read_timeout": 60,
+    "gfm_max_retries": 3,
+    "gfm_backoff_factor": 0.5,
+    ## Product queries are split into windows of this many days, fetched concurrently
+    "product_query_window_days": 7,
+    # Product ingestion
+    ## Downloads run in background workers from a persistent queue
+    "ingest_queue_path": os.environ.get(
+        "ingest_queue_path", ".cache/ingest_queue.sqlite"
+    ),
+    "ingest_workers": 1,
+    "ingest_batch_size": 10,
+    "ingest_poll_interval_seconds": 5,
+    ## Running jobs hold a lease that their worker renews, jobs whose lease expired
+    ## were abandoned, e.g. by a process that stopped, and are queued again
+    "ingest_lease_seconds": 120,
+    ## Tolerances in degrees to simplify flood layers with, chosen by the extent of the AOI
+    "flood_simplify_tolerances": [0.0001, 0.0005, 0.002],
+    ## Render flood layers as vector tiles from a local endpoint instead of inline geojson,
+    ## the endpoint must be reachable from the browser at vector_tiles_url.
+    ## It only listens on localhost, set vector_tiles_host to 0.0.0.0 to serve other machines
+    "vector_tiles_enabled": os.environ.get("vector_tiles_enabled", "false") == "true",
+    "vector_tiles_host": os.environ.get("vector_tiles_host", "127.0.0.1"),
+    "vector_tiles_port": 8765,
+    "vector_tiles_url": os.environ.get("vector_tiles_url", "http://localhost:8765"),
+    # Instrumentation
+    ## Record timings and byte counts of the hot paths, shown on the Metrics page
+    "metrics_enabled": os.environ.get("metrics_enabled", "false") == "true",
+    # Prefetch of new products for watched AOIs, see src/prefetch.py
+    ## Comma separated AOI ids
+    "prefetch_watched_aois": [
+        aoi_id
+        for aoi_id in os.environ.get("prefetch_watched_aois", "").split(",")
+        if aoi_id
+    ],
+    "prefetch_interval_minutes": 10,
+    ## Products are looked for from this many days ago until now
+    "prefetch_lookback_days": 2,
+    # Caching
+    ## Product listings, intervals reaching into the last days expire sooner
+    ## since new Sentinel-1 products can still show up for them
+    "product_listing_recent_days": 3,
+    "product_listing_recent_ttl_minutes": 30,
+    "product_listing_ttl_hours": 24,
+    ## Seconds after which the product index is revalidated in the background
+    "index_refresh_ttl_seconds": 60,
+    ## Product geojson cache
+    "product_cache_dir": os.environ.get("product_cache_dir", ".cache/products"),
+    "product_cache_memory_mb": 512,
+    "product_cache_disk_mb": 4096,
+    ## Flood and footprint layers merged per time group
+    "merged_layer_cache_dir": os.environ.get(
+        "merged_layer_cache_dir", ".cache/merged_layers"
+    ),
+    "merged_layer_memory_entries": 64,
+    # Flood frequency composite
+    ## Pixel size in degrees (about 50 m), coarsened for large AOIs to stay below max pixels
+    "composite_resolution_deg": 0.0005,
+    "composite_max_pixels": 4_000_000,
 }
@@ -0,0 +1,153 @@
+"""Flood frequency composites: the floods of many products rasterised onto one grid."""
+
+import base64
+import io
+import math
+
+import numpy as np
+import shapely
+import streamlit as st
+from PIL import Image
+
+from src import hf_utils
+from src.config_parameters import params
+from src.gfm import (
+    get_cached_aois,
+    get_cached_gfm_handler,
+    group_products_by_time,
+)
+from src.product_listing_cache import get_cached_product_listing_cache
+from src.utils import get_aoi_bounds, get_existing_geodataframe
+
+# Colors of the lowest and highest flood frequency, as RGBA
+LOW_FREQUENCY_COLOR = np.array([158, 202, 225, 200])
+HIGH_FREQUENCY_COLOR = np.array([8, 48, 107, 230])
+
+
+def composite_resolution(bounds, resolution, max_pixels):
+    """The resolution in degrees, coarsened if the grid would exceed max_pixels"""
+    min_x, min_y, max_x, max_y = bounds
+    area = (max_x - min_x) * (max_y - min_y)
+    return max(resolution, math.sqrt(area / max_pixels))
+
+
+def rasterize(geometries, bounds, resolution):
+    """
+    Boolean grid of the pixels whose center lies in one of the geometries,
+    with rows from north to south. Each polygon is only tested against the
+    pixels within its own bounds.
+    """
+    min_x, min_y, max_x, max_y = bounds
+    width = max(1, math.ceil((max_x - min_x) / resolution))
+    height = max(1, math.ceil((max_y - min_y) / resolution))
+    grid = np.zeros((height, width), dtype=bool)
+
+    polygons = shapely.get_parts(shapely.make_valid(np.asarray(geometries)))
+    polygons = polygons[shapely.area(polygons) > 0]
+    shapely.prepare(polygons)
+    for polygon, (p_min_x, p_min_y, p_max_x, p_max_y) in zip(
+        polygons, shapely.bounds(polygons)
+    ):
+        col_start = max(0, math.floor((p_min_x - min_x) / resolution))
+        col_end = min(width, math.ceil((p_max_x - min_x) / resolution))
+        row_start = max(0, math.floor((max_y - p_max_y) / resolution))
+        row_end = min(height, math.ceil((max_y - p_min_y) / resolution))
+        if col_start >= col_end or row_start >= row_end:
+            continue
+        xs = min_x + (np.arange(col_start, col_end) + 0.5) * resolution
+        ys = max_y - (np.arange(row_start, row_end) + 0.5) * resolution
+        grid[row_start:row_end, col_start:col_end] |= shapely.contains_xy(
+            polygon, *np.meshgrid(xs, ys)
+        )
+    return grid
+
+
+def frequency_image(flood_count, observed_count):
+    """
+    RGBA image of the share of observations that were flooded,
+    pixels that were never flooded are transparent.
+    """
+    frequency = np.divide(
+        flood_count,
+        observed_count,
+        out=np.zeros(flood_count.shape),
+        where=observed_count > 0,
+    )
+    rgba = LOW_FREQUENCY_COLOR + frequency[..., None] * (
+        HIGH_FREQUENCY_COLOR - LOW_FREQUENCY_COLOR
+    )
+    rgba[flood_count == 0] = 0
+    return Image.fromarray(rgba.astype(np.uint8), mode="RGBA")
+
+
+def _products_in_range(area_id, start_date, end_date):
+    """
+    Products of the AOI in the date range that are in the dataset. They are taken from
+    the GFM listing like on the page, as the index only records the AOI a product was
+    first ingested under, which misses products shared with an overlapping AOI.
+    """
+    geojson_index = hf_utils.get_geojson_index()
+    return [
+        product
+        for window_products in get_cached_product_listing_cache().iter_products(
+            get_cached_gfm_handler(),
+            area_id,
+            start_date,
+            end_date,
+            window_days=params["product_query_window_days"],
+        )
+        for product in window_products
+        if product["product_id"] in geojson_index
+    ]
+
+
+def get_flood_composite(area_id, start_date, end_date):
+    """
+    Flood frequency composite of the products in the dataset for the AOI and date range.
+    Returns a dict with the image as a data url, its bounds and the number of time groups,
+    None if there are no products.
+    """
+    products = _products_in_range(area_id, start_date, end_date)
+    if not products:
+        return None
+    bounds = get_aoi_bounds(get_cached_aois()[area_id])
+    resolution = composite_resolution(
+        bounds, params["composite_resolution_deg"], params["composite_max_pixels"]
+    )
+    product_ids_per_group = tuple(
+        tuple(product["product_id"] for product in products_in_group)
+        for products_in_group in group_products_by_time(products).values()
+    )
+    return _compute_flood_composite(area_id, bounds, resolution, product_ids_per_group)
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _compute_flood_composite(area_id, bounds, resolution, product_ids_per_group):
+    """
+    Cached per AOI, resolution and products, which cover the date range,
+    so a composite is recomputed when a product for the range is added.
+    """
+    flood_count = observed_count = 0
+    # Products of a time group are combined first, so where they overlap
+    # a flood is still counted once for that time
+    for product_ids in product_ids_per_group:
+        flooded = observed = False
+        for product_id in product_ids:
+            flood = get_existing_geodataframe(product_id, "flood", bounds)
+            footprint = get_existing_geodataframe(product_id, "footprint", bounds)
+            flooded = flooded | rasterize(flood.geometry.values, bounds, resolution)
+            observed = observed | rasterize(
+                footprint.geometry.values, bounds, resolution
+            )
+        flood_count = flood_count + (flooded & observed).astype(np.uint16)
+        observed_count = observed_count + observed.astype(np.uint16)
+
+    buffer = io.BytesIO()
+    frequency_image(flood_count, observed_count).save(buffer, format="PNG")
+    min_x, min_y, max_x, max_y = bounds
+    return {
+        "image_url": "data:image/png;base64,"
+        + base64.b64encode(buffer.getvalue()).decode(),
+        "bounds": [[min_y, min_x], [max_y, max_x]],
+        "time_groups": len(product_ids_per_group),
+    }
@@ -0,0 +1,75 @@
+"""Flooded area statistics of products and time groups within an AOI."""
+
+import geopandas as gpd
+import shapely
+import streamlit as st
+from shapely.geometry import shape
+
+from src.gfm import get_cached_aois
+from src.merged_layers import get_cached_merged_layer_cache
+from src.utils import get_aoi_bounds, get_existing_geodataframe
+
+# World cylindrical equal area, so areas are comparable between AOIs at any latitude
+EQUAL_AREA_CRS = "EPSG:6933"
+SQUARE_METERS_PER_KM2 = 1_000_000
+
+
+def _area_km2(geometry):
+    area = gpd.GeoSeries([geometry], crs="EPSG:4326").to_crs(EQUAL_AREA_CRS).area
+    return float(area.iloc[0]) / SQUARE_METERS_PER_KM2
+
+
+def flood_area_stats(flood_gdf, footprint_gdf, aoi_geometry):
+    """
+    Flooded and observed area in km² within the AOI.
+    The observed area is the part of the AOI covered by the footprint,
+    floods are clipped to it and overlapping floods are only counted once.
+    """
+    observed = shapely.intersection(
+        shapely.union_all(shapely.make_valid(footprint_gdf.geometry.values)),
+        aoi_geometry,
+    )
+    flooded = shapely.intersection(
+        shapely.union_all(shapely.make_valid(flood_gdf.geometry.values)), observed
+    )
+    flooded_km2 = _area_km2(flooded)
+    observed_km2 = _area_km2(observed)
+    return {
+        "flooded_km2": flooded_km2,
+        "observed_km2": observed_km2,
+        "flooded_percentage": 100 * flooded_km2 / observed_km2 if observed_km2 else 0,
+    }
+
+
+def _aoi_geometry(area_id):
+    aoi = get_cached_aois()[area_id]
+    return shape(aoi["bbox"].get("geometry", aoi["bbox"])), get_aoi_bounds(aoi)
+
+
+@st.cache_data(show_spinner=False, max_entries=1000)
+def get_product_flood_stats(area_id, product_id):
+    """Flooded area statistics of one product within the AOI, cached per product"""
+    aoi_geometry, aoi_bounds = _aoi_geometry(area_id)
+    return flood_area_stats(
+        get_existing_geodataframe(product_id, "flood", aoi_bounds),
+        get_existing_geodataframe(product_id, "footprint", aoi_bounds),
+        aoi_geometry,
+    )
+
+
+@st.cache_data(show_spinner=False, max_entries=1000)
+def get_time_group_flood_stats(area_id, time_group, product_ids: tuple):
+    """
+    Flooded area statistics of a time group within the AOI, computed from the
+    merged layers of its products, so floods in overlapping products count once.
+    """
+    if len(product_ids) == 1:
+        return get_product_flood_stats(area_id, product_ids[0])
+
+    aoi_geometry, aoi_bounds = _aoi_geometry(area_id)
+    merged_layer_cache = get_cached_merged_layer_cache()
+    flood_gdf, footprint_gdf = (
+        merged_layer_cache.get(area_id, time_group, file_type, product_ids, aoi_bounds)
+        for file_type in ["flood", "footprint"]
+    )
+    return flood_area_stats(flood_gdf, footprint_gdf, aoi_geometry)
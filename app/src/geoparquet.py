@@ -0,0 +1,62 @@
+"""GeoParquet copies of product geojsons, compact and readable without parsing all of the text."""
+
+import json
+
+import geopandas as gpd
+import numpy as np
+import pyarrow.parquet as pq
+import shapely
+
+GEOPARQUET_FOLDER = "flood-geoparquet"
+# Rows are sorted spatially, so the bbox statistics of a row group cover a small area
+# and row groups outside a requested bbox are not decoded when reading a local file
+ROW_GROUP_SIZE = 1000
+
+
+def geoparquet_path(geojson_path_in_repo):
+    """Path in the dataset of the GeoParquet version of a product geojson"""
+    filename = geojson_path_in_repo.split("/")[-1].removesuffix(".geojson")
+    return f"{GEOPARQUET_FOLDER}/{filename}.parquet"
+
+
+def write_geoparquet(src_path, dest_path):
+    write_geodataframe(gpd.read_file(src_path), dest_path)
+
+
+def write_geodataframe(gdf, dest_path):
+    if not gdf.empty:
+        gdf = gdf.iloc[gdf.hilbert_distance().argsort()]
+    gdf.to_parquet(
+        dest_path,
+        index=False,
+        compression="zstd",
+        write_covering_bbox=True,
+        row_group_size=ROW_GROUP_SIZE,
+    )
+
+
+def _has_bbox_covering(path):
+    geo_metadata = json.loads(pq.read_schema(path).metadata[b"geo"])
+    primary_column = geo_metadata["primary_column"]
+    return "covering" in geo_metadata["columns"][primary_column]
+
+
+def read_geoparquet(path, bbox=None):
+    """
+    Read a GeoParquet file, memory mapped so columns are not copied into memory.
+    With a bbox (min_x, min_y, max_x, max_y) only the geometries intersecting it are returned,
+    decoding only the row groups that overlap it.
+    """
+    if bbox is None:
+        return gpd.read_parquet(path, memory_map=True)
+    if _has_bbox_covering(path):
+        gdf = gpd.read_parquet(path, bbox=bbox, memory_map=True)
+    else:
+        gdf = gpd.read_parquet(path, memory_map=True)
+    return filter_bbox(gdf, bbox)
+
+
+def filter_bbox(gdf, bbox):
+    """Geometries intersecting the bbox, found through the spatial index"""
+    positions = gdf.sindex.query(shapely.box(*bbox), predicate="intersects")
+    return gdf.iloc[np.sort(positions)]
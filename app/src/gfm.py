@@ -1,80 +1,198 @@
-import io
+import base64
+import json
 import os
+import shutil
+import tempfile
+import threading
+import time
 import zipfile
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
 
+import numpy as np
 import pandas as pd
 import requests
 import streamlit as st
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-from src import hf_utils
+from src import hf_utils, metrics
+from src.config_parameters import params
+from src.geoparquet import geoparquet_path, write_geoparquet
+from src.product_listing_cache import get_cached_product_listing_cache
 
 load_dotenv()
 
-
-@st.cache_resource
-def get_gfm_user_and_token():
-    username = os.environ["gfm_username"]
-    password = os.environ["gfm_password"]
-    base_url = "https://api.gfm.eodc.eu/v1"
-
-    # Get token, setup header
-    token_url = f"{base_url}/auth/login"
-
-    payload = {"email": username, "password": password}
-
-    response = requests.post(token_url, json=payload)
-    user_id = response.json()["client_id"]
-    access_token = response.json()["access_token"]
-    print("retrieved user id and access token")
-
-    return user_id, access_token
+# Size of the chunks in which product archives are streamed to disk
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# Seconds before its expiry at which the access token is refreshed
+TOKEN_REFRESH_MARGIN = 60
 
 
 class GFMHandler:
-    def __init__(self):
-        self.base_url = "https://api.gfm.eodc.eu/v1"
-        self.user_id, self.access_token = self._get_gfm_user_and_token()
-        self.header = {"Authorization": f"bearer {self.access_token}"}
+    """
+    Synchronous client of the GFM API. All requests go through one pooled requests
+    Session, so the handler can be shared between threads: listing windows and product
+    downloads run concurrently on thread pools, not on an asyncio event loop.
+    """
+
+    def __init__(
+        self,
+        pool_size=10,
+        connect_timeout=5,
+        read_timeout=60,
+        max_retries=3,
+        backoff_factor=0.5,
+        base_url="https://api.gfm.eodc.eu/v1",
+        max_requests_per_second=None,
+    ):
+        self.base_url = base_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = _create_session(pool_size, max_retries, backoff_factor)
+        self.rate_limiter = (
+            RateLimiter(max_requests_per_second) if max_requests_per_second else None
+        )
+        self._token_lock = threading.Lock()
+        # The token and its expiry are replaced together as one tuple,
+        # so threads reading it without the lock never see a mixed pair
+        self.user_id, access_token, expires_at = self._get_gfm_user_and_token()
+        self._token = (access_token, expires_at)
 
     def _get_gfm_user_and_token(self):
         username = os.environ["gfm_username"]
         password = os.environ["gfm_password"]
 
-        # Get token, setup header
+        # Get token
         token_url = f"{self.base_url}/auth/login"
         payload = {"email": username, "password": password}
 
-        response = requests.post(token_url, json=payload)
+        response = self.session.post(token_url, json=payload, timeout=self.timeout)
+        response.raise_for_status()
         user_id = response.json()["client_id"]
         access_token = response.json()["access_token"]
+        expires_at = _get_token_expiry(access_token)
         print("retrieved user id and access token")
 
-        return user_id, access_token
-
-    def _refresh_token(self):
-        """Refresh the access token and update the authorization header"""
-        self.user_id, self.access_token = self._get_gfm_user_and_token()
-        self.header = {"Authorization": f"bearer {self.access_token}"}
-        print("Refreshed access token")
+        return user_id, access_token, expires_at
+
+    @property
+    def access_token(self):
+        return self._token[0]
+
+    def _refresh_token(self, stale_token):
+        """
+        Refresh the access token and return the new one.
+        Concurrent callers share a single refresh: only the first caller holding stale_token
+        logs in again, the others find the token already replaced once they get the lock.
+        """
+        with self._token_lock:
+            if self._token[0] == stale_token:
+                self.user_id, access_token, expires_at = self._get_gfm_user_and_token()
+                self._token = (access_token, expires_at)
+                print("Refreshed access token")
+            return self._token[0]
+
+    def _get_valid_token(self):
+        """Current access token, refreshed first if it expires within TOKEN_REFRESH_MARGIN"""
+        access_token, expires_at = self._token
+        if expires_at is not None and time.time() > expires_at - TOKEN_REFRESH_MARGIN:
+            print("Token about to expire, refreshing...")
+            access_token = self._refresh_token(access_token)
+        return access_token
 
     def _make_request(self, method, url, **kwargs):
-        """Make an API request with automatic token refresh on authentication failure"""
+        """Make an API request, refreshing the token before it expires or on authentication failure"""
+        # The first part of the path, ids further on would give too many distinct labels
+        endpoint = url.removeprefix(self.base_url).strip("/").split("/")[0]
         try:
-            response = requests.request(method, url, headers=self.header, **kwargs)
-            if response.status_code == 401:  # Unauthorized
-                print("Token expired, refreshing...")
-                self._refresh_token()
-                # Retry the request with new token
-                response = requests.request(method, url, headers=self.header, **kwargs)
-            response.raise_for_status()
+            with metrics.span("gfm_request", method=method, endpoint=endpoint):
+                kwargs.setdefault("timeout", self.timeout)
+                access_token = self._get_valid_token()
+                self._wait_for_rate_limit()
+                response = self.session.request(
+                    method, url, headers=_auth_header(access_token), **kwargs
+                )
+                if response.status_code == 401:  # Unauthorized
+                    print("Token expired, refreshing...")
+                    access_token = self._refresh_token(access_token)
+                    # Retry the request with new token
+                    self._wait_for_rate_limit()
+                    response = self.session.request(
+                        method, url, headers=_auth_header(access_token), **kwargs
+                    )
+                response.raise_for_status()
+            metrics.count_bytes(
+                "gfm_response", len(response.content), endpoint=endpoint
+            )
             return response
         except requests.exceptions.RequestException as e:
             print(f"Request failed: {e}")
             raise
 
-    def get_area_products(self, area_id, from_date, to_date):
+    def _wait_for_rate_limit(self):
+        if self.rate_limiter:
+            self.rate_limiter.wait()
+
+    def get_area_products(
+        self,
+        area_id,
+        from_date,
+        to_date,
+        time_group_tolerance=timedelta(minutes=1),
+        window_days=None,
+        max_workers=4,
+    ):
+        """
+        Get all products for the AOI in the date range, grouped by product time group.
+        If window_days is given the range is queried in windows, see iter_area_products.
+        """
+        if window_days is None:
+            products = self._get_products_in_range(area_id, from_date, to_date)
+        else:
+            products = [
+                product
+                for window_products in self.iter_area_products(
+                    area_id, from_date, to_date, window_days, max_workers
+                )
+                for product in window_products
+            ]
+        print(f"Found {len(products)} products for {area_id}")
+
+        return group_products_by_time(products, time_group_tolerance)
+
+    def iter_area_products(
+        self, area_id, from_date, to_date, window_days=7, max_workers=4
+    ):
+        """
+        Split the date range into windows of window_days and fetch them concurrently.
+        Yields the products of each window as soon as it is returned, without products
+        already yielded for another window.
+        """
+        windows = []
+        window_start = from_date
+        while window_start < to_date:
+            window_end = min(window_start + timedelta(days=window_days), to_date)
+            windows.append((window_start, window_end))
+            window_start = window_end
+
+        seen_product_ids = set()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(self._get_products_in_range, area_id, start, end)
+                for start, end in windows
+            ]
+            for future in as_completed(futures):
+                # Products at a window boundary are returned for both windows
+                window_products = [
+                    p
+                    for p in future.result()
+                    if p["product_id"] not in seen_product_ids
+                ]
+                seen_product_ids.update(p["product_id"] for p in window_products)
+                yield window_products
+
+    def _get_products_in_range(self, area_id, from_date, to_date):
         params = {
             "time": "range",
             "from": f"{from_date}T00:00:00",
@@ -82,35 +200,60 @@ class GFMHandler:
         }
         prod_url = f"{self.base_url}/aoi/{area_id}/products"
         response = self._make_request("GET", prod_url, params=params)
-        products = response.json()["products"]
-        print(f"Found {len(products)} products for {area_id}")
-
-        # Sort products by timestamp
-        products.sort(key=lambda x: x["product_time"])
-
-        # Group products that are within 1 minute of each other
-        if products:
-            current_group_time = products[0]["product_time"]
-            products[0]["product_time_group"] = current_group_time
-
-            for i in range(1, len(products)):
-                product_time = datetime.fromisoformat(
-                    products[i]["product_time"].replace("Z", "+00:00")
-                )
-                current_time = datetime.fromisoformat(
-                    current_group_time.replace("Z", "+00:00")
-                )
-                time_diff = product_time - current_time
-
-                # If more than 1 minute apart, start a new group
-                if time_diff > timedelta(minutes=1):
-                    current_group_time = products[i]["product_time"]
-
-                products[i]["product_time_group"] = current_group_time
-
-        return products
+        return response.json()["products"]
 
     def download_flood_product(self, area_id, product):
+        with hf_utils.DatasetWriter() as dataset_writer:
+            self._fetch_flood_product(area_id, product, dataset_writer)
+            dataset_writer.commit()
+
+        print(f"Product {product['product_id']} downloaded succesfully")
+
+    def download_flood_products(
+        self, area_id, products, max_workers=4, progress_callback=None
+    ):
+        """
+        Download multiple products concurrently on a bounded thread pool.
+        All files and index rows are pushed as a single commit after all products have been fetched.
+        A failing product does not abort the batch, instead the error is returned per product_id.
+        progress_callback is called as progress_callback(n_done, n_total, product, error).
+        """
+        errors = {}
+        n_total = len(products)
+
+        with hf_utils.DatasetWriter() as dataset_writer:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {
+                    executor.submit(
+                        self._fetch_flood_product, area_id, product, dataset_writer
+                    ): product
+                    for product in products
+                }
+                for n_done, future in enumerate(as_completed(futures), start=1):
+                    product = futures[future]
+                    error = None
+                    try:
+                        future.result()
+                    except Exception as e:
+                        print(f"Product {product['product_id']} failed: {e}")
+                        error = e
+                    errors[product["product_id"]] = error
+
+                    if progress_callback:
+                        progress_callback(n_done, n_total, product, error)
+
+            n_succeeded = len(dataset_writer.rows)
+            dataset_writer.commit()
+
+        print(f"Downloaded {n_succeeded} of {n_total} products succesfully")
+        return errors
+
+    def _fetch_flood_product(self, area_id, product, dataset_writer):
+        """Download a product from GFM and stage its geojsons and index row in the dataset writer"""
+        with metrics.span("download_flood_product"):
+            self._stage_flood_product(area_id, product, dataset_writer)
+
+    def _stage_flood_product(self, area_id, product, dataset_writer):
         product_id = product["product_id"]
         product_time = product["product_time"]
 
@@ -120,46 +263,56 @@ class GFMHandler:
         response = self._make_request("GET", download_url)
         download_link = response.json()["download_link"]
 
-        # Download and unzip file
-        r = requests.get(download_link)
-        buffer = io.BytesIO(r.content)
-        hf_api = hf_utils.get_hf_api()
-
         data = {
             "aoi_id": area_id,
             "datetime": product_time,
             "product": product_id,
         }
 
-        with zipfile.ZipFile(buffer, "r") as z:
-            namelist = z.namelist()
-
-            for file_type in ["flood", "footprint"]:
-                filename = next(
-                    name
-                    for name in namelist
-                    if file_type in name.lower() and name.endswith(".geojson")
-                )
-
-                path_in_repo = f"flood-geojson/{filename}"
-
-                with z.open(filename) as f:
-                    hf_api.upload_file(
-                        path_or_fileobj=f,
-                        path_in_repo=path_in_repo,
-                        repo_id="rodekruis/flood-mapping",
-                        repo_type="dataset",
+        # Stream the archive to a temporary file so memory use does not depend on its size,
+        # then only extract the flood and footprint geojsons to the staging folder.
+        # Files are only staged once all are written, so a failing product stages nothing
+        files = {}
+        with tempfile.TemporaryFile() as archive:
+            with self.session.get(
+                download_link, stream=True, timeout=self.timeout
+            ) as r:
+                r.raise_for_status()
+                for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    archive.write(chunk)
+            metrics.count_bytes("gfm_archive", archive.tell())
+            archive.seek(0)
+
+            with zipfile.ZipFile(archive, "r") as z:
+                namelist = z.namelist()
+
+                for file_type in ["flood", "footprint"]:
+                    filename = next(
+                        name
+                        for name in namelist
+                        if file_type in name.lower() and name.endswith(".geojson")
                     )
 
-                data[f"{file_type}_geojson_path"] = path_in_repo
+                    path_in_repo = f"flood-geojson/{filename}"
+                    local_path = dataset_writer.staging_path(path_in_repo)
+                    with z.open(filename) as src, open(local_path, "wb") as dst:
+                        shutil.copyfileobj(src, dst, DOWNLOAD_CHUNK_SIZE)
 
-        df = pd.DataFrame([data])
+                    files[path_in_repo] = local_path
+                    data[f"{file_type}_geojson_path"] = path_in_repo
 
-        index_df = hf_utils.get_geojson_index_df()
-        index_df = pd.concat([index_df, df], ignore_index=True)
-        hf_utils.update_geojson_index_df(index_df)
+        # GeoParquet copies for reading without parsing the geojson text
+        for file_type in ["flood", "footprint"]:
+            geojson_path = data[f"{file_type}_geojson_path"]
+            parquet_path = geoparquet_path(geojson_path)
+            parquet_local_path = dataset_writer.staging_path(parquet_path)
+            write_geoparquet(files[geojson_path], parquet_local_path)
+            files[parquet_path] = parquet_local_path
+            data[f"{file_type}_geoparquet_path"] = parquet_path
 
-        print(f"Product {product_id} downloaded succesfully")
+        for path_in_repo, local_path in files.items():
+            dataset_writer.add_file(path_in_repo, local_path)
+        dataset_writer.add_index_row(data)
 
     def retrieve_all_aois(self):
         print("Retrieving all AOIs from GFM API")
@@ -200,12 +353,114 @@ class GFMHandler:
 
         self._make_request("DELETE", delete_aoi_url)
         get_cached_aois.clear()
+        get_cached_product_listing_cache().invalidate(aoi_id)
         print("AOI deleted")
 
 
+def group_products_by_time(products, tolerance=timedelta(minutes=1)):
+    """
+    Group products that were acquired together, a new group starts with the first product
+    that is more than tolerance after the first product of the current group. Returns a dict
+    of time group -> products, both sorted by product time. The time group is the time of
+    the first product in the group and is also set as product_time_group on each product.
+    """
+    if not products:
+        return {}
+
+    # As datetime64 in UTC, a tz aware series would give an object array of Timestamps
+    product_times = (
+        pd.to_datetime(
+            pd.Series([p["product_time"] for p in products]), utc=True, format="ISO8601"
+        )
+        .dt.tz_convert(None)
+        .to_numpy()
+    )
+    order = np.argsort(product_times, kind="stable")
+    sorted_times = product_times[order]
+
+    # For each product the first product more than tolerance after it, in one binary
+    # search over all products, then follow it from group start to group start
+    next_starts = np.searchsorted(
+        sorted_times, sorted_times + np.timedelta64(tolerance), side="right"
+    ).tolist()
+    group_starts = [0]
+    while next_starts[group_starts[-1]] < len(products):
+        group_starts.append(next_starts[group_starts[-1]])
+    group_start = np.repeat(group_starts, np.diff([*group_starts, len(products)]))
+
+    product_groups = {}
+    for i, start in zip(order, order[group_start]):
+        time_group = products[start]["product_time"]
+        products[i]["product_time_group"] = time_group
+        product_groups.setdefault(time_group, []).append(products[i])
+
+    return product_groups
+
+
+def _auth_header(access_token):
+    return {"Authorization": f"bearer {access_token}"}
+
+
+def _get_token_expiry(access_token):
+    """Expiry timestamp from the exp claim of the JWT access token, None if it has none"""
+    try:
+        payload = access_token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """Spaces calls to wait() at least 1 / max_per_second seconds apart, across threads"""
+
+    def __init__(self, max_per_second):
+        self.interval = 1 / max_per_second
+        self._next_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            wait_until = max(self._next_at, now)
+            self._next_at = wait_until + self.interval
+        time.sleep(wait_until - now)
+
+
+def _create_session(pool_size, max_retries, backoff_factor):
+    """
+    Session with a connection pool of pool_size that retries connection errors and
+    429/5xx responses with exponential backoff, respecting Retry-After headers.
+    Responses to POST requests are not retried, to never create an AOI twice.
+    """
+    retry = Retry(
+        total=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(429, 500, 502, 503, 504),
+        respect_retry_after_header=True,
+        # Return the last response so raise_for_status reports the actual error
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
 @st.cache_resource
 def get_cached_gfm_handler():
-    return GFMHandler()
+    return GFMHandler(
+        pool_size=params["gfm_pool_size"],
+        connect_timeout=params["gfm_connect_timeout"],
+        read_timeout=params["gfm_read_timeout"],
+        max_retries=params["gfm_max_retries"],
+        backoff_factor=params["gfm_backoff_factor"],
+        base_url=params["gfm_base_url"],
+        max_requests_per_second=params["gfm_max_requests_per_second"],
+    )
 
 
 @st.cache_resource
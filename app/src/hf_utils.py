@@ -1,41 +1,364 @@
 import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+from types import SimpleNamespace
 
 import pandas as pd
+import requests
 import streamlit as st
-from huggingface_hub import HfApi
+from filelock import FileLock
+from huggingface_hub import CommitOperationAdd, HfApi
+from huggingface_hub.errors import EntryNotFoundError, HfHubHTTPError
+
+from src import metrics
+from src.config_parameters import params
+
+REPO_ID = "rodekruis/flood-mapping"
+REPO_TYPE = "dataset"
+INDEX_FILENAME = "index.parquet"
+INDEX_COLUMNS = [
+    "aoi_id",
+    "datetime",
+    "product",
+    "flood_geojson_path",
+    "footprint_geojson_path",
+    "flood_geoparquet_path",
+    "footprint_geoparquet_path",
+]
+
+# Serialises index commits within this process, commits from other processes are
+# detected through the parent commit check in DatasetWriter.commit
+_index_commit_lock = threading.Lock()
 
 
 @st.cache_resource
 def get_hf_api() -> HfApi:
+    local_dataset_dir = os.environ.get("hf_local_dataset_dir")
+    if local_dataset_dir:
+        return LocalHfApi(local_dataset_dir)
     return HfApi()
 
 
-@st.cache_resource
-def get_geojson_index_df():
-    hf_api = get_hf_api()
+class GeojsonIndex:
+    """
+    The index dataframe together with hash lookups by product_id and by aoi_id,
+    built once per version of the index. The lookup by aoi_id is incomplete for
+    overlapping AOIs, see products_for_aoi.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self.by_product = {row["product"]: row for row in df.to_dict("records")}
+        self.by_aoi = defaultdict(list)
+        for product_id, row in self.by_product.items():
+            self.by_aoi[row["aoi_id"]].append(product_id)
+
+    def __contains__(self, product_id):
+        return product_id in self.by_product
+
+    def __len__(self):
+        return len(self.by_product)
+
+    def get(self, product_id):
+        """Index row as a dict, None if the product is not in the index"""
+        return self.by_product.get(product_id)
+
+    def products_for_aoi(self, aoi_id):
+        """
+        Products ingested under the AOI. A product is only recorded under the AOI it was
+        first ingested for, so products of an overlapping AOI are missing: to find all
+        products of an AOI, filter the GFM listing by membership in the index instead.
+        """
+        return self.by_aoi.get(aoi_id, [])
+
+
+def _read_index_at_revision(hf_api: HfApi, revision: str) -> pd.DataFrame:
     try:
         index_path = hf_api.hf_hub_download(
-            repo_id="rodekruis/flood-mapping",
-            filename="index.parquet",
-            repo_type="dataset",
-            force_download=True,
+            repo_id=REPO_ID,
+            filename=INDEX_FILENAME,
+            repo_type=REPO_TYPE,
+            revision=revision,
         )
-        return pd.read_parquet(index_path)
-    except Exception as e:
-        st.warning(f"No index.parquet found on Hugging Face: {e}")
-        return pd.DataFrame(columns=["aoi_id", "datetime", "product", "path_in_repo"])
+    except EntryNotFoundError:
+        return pd.DataFrame(columns=INDEX_COLUMNS)
+    metrics.count_bytes("hf_download", os.path.getsize(index_path), file="index")
+    return pd.read_parquet(index_path)
+
+
+class GeojsonIndexLoader:
+    """
+    Keeps the latest GeojsonIndex in memory and revalidates it against the revision of the
+    dataset repo. The index is only downloaded and parsed again when the revision changed.
+    Once the index is older than ttl_seconds it is revalidated in a background thread,
+    so a page render never waits for it apart from the very first load.
+    """
+
+    def __init__(self, ttl_seconds):
+        self.ttl_seconds = ttl_seconds
+        self.revision = None
+        self._index = None
+        self._checked_at = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+        # Held during the first load, so concurrent sessions download the index only once
+        self._load_lock = threading.Lock()
+
+    def get(self) -> GeojsonIndex:
+        with self._lock:
+            index = self._index
+            stale = time.monotonic() - self._checked_at > self.ttl_seconds
+            start_refresh = index is not None and stale and not self._refreshing
+            if start_refresh:
+                self._refreshing = True
+
+        if index is None:
+            with self._load_lock:
+                if self._index is None:
+                    self._first_load()
+            return self._index
+
+        if start_refresh:
+            threading.Thread(target=self._refresh_in_background, daemon=True).start()
+        return index
+
+    def _first_load(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            st.warning(f"No index.parquet found on Hugging Face: {e}")
+            with self._lock:
+                self._index = GeojsonIndex(pd.DataFrame(columns=INDEX_COLUMNS))
+                self.revision = None
+                self._checked_at = time.monotonic()
+
+    def refresh(self):
+        """Revalidate against the remote revision, only downloading the index when it changed"""
+        with metrics.span("index_refresh"):
+            self._refresh()
+
+    def _refresh(self):
+        hf_api = get_hf_api()
+        known_revision = self.revision
+        revision = hf_api.repo_info(repo_id=REPO_ID, repo_type=REPO_TYPE).sha
+        if revision == known_revision:
+            with self._lock:
+                self._checked_at = time.monotonic()
+            return
+
+        index = GeojsonIndex(_read_index_at_revision(hf_api, revision))
+        with self._lock:
+            # Don't replace an index that was updated in the meantime by a commit
+            if self.revision != known_revision:
+                return
+            self._index = index
+            self.revision = revision
+            self._checked_at = time.monotonic()
+        print(f"Loaded index at revision {revision}")
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            print(f"Refreshing index failed, keeping the current one: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def update(self, index_df: pd.DataFrame, revision):
+        """
+        Replace the index with the one just committed at revision by this process.
+        Only done while revision is still the head of the dataset repo and no refresh
+        loaded another index meanwhile, so a newer index is never replaced by an older one.
+        Otherwise the current index is revalidated on the next get().
+        """
+        with self._lock:
+            known_revision = self.revision
+        head = get_hf_api().repo_info(repo_id=REPO_ID, repo_type=REPO_TYPE).sha
+        index = GeojsonIndex(index_df) if head == revision else None
+        with self._lock:
+            if self.revision != known_revision:
+                return
+            if index is None:
+                self._checked_at = 0.0
+                return
+            self._index = index
+            self.revision = revision
+            self._checked_at = time.monotonic()
+
+
+@st.cache_resource
+def get_cached_geojson_index_loader() -> GeojsonIndexLoader:
+    return GeojsonIndexLoader(ttl_seconds=params["index_refresh_ttl_seconds"])
+
+
+def get_geojson_index() -> GeojsonIndex:
+    return get_cached_geojson_index_loader().get()
+
+
+class DatasetWriter:
+    """
+    Stages files and index rows and pushes them to the dataset repo as a single commit.
+    The commit is made against the revision the index was read from, so rows appended
+    concurrently by another session are never overwritten: on a conflict the latest
+    index is re-read and the rows are merged again.
+    Use as a context manager to remove the staging folder afterwards.
+    """
+
+    def __init__(self, max_attempts=5):
+        self.max_attempts = max_attempts
+        self.files = []
+        self.rows = []
+        self.staging_dir = Path(tempfile.mkdtemp(prefix="flood-mapping-"))
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+
+    def staging_path(self, path_in_repo: str) -> Path:
+        """Local path in the staging folder to write a file to before staging it"""
+        path = self.staging_dir / path_in_repo
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def add_file(self, path_in_repo: str, source):
+        """Stage a file, source can be a local path or bytes"""
+        if isinstance(source, Path):
+            source = str(source)
+        with self._lock:
+            self.files.append((path_in_repo, source))
+
+    def add_index_row(self, row: dict):
+        with self._lock:
+            self.rows.append(row)
+
+    def commit(self):
+        with self._lock:
+            files = list(self.files)
+            rows = list(self.rows)
+        if not files and not rows:
+            return
+
+        hf_api = get_hf_api()
+        new_df = pd.DataFrame(rows)
+
+        with _index_commit_lock, metrics.span("dataset_commit"):
+            for attempt in range(1, self.max_attempts + 1):
+                head = hf_api.repo_info(repo_id=REPO_ID, repo_type=REPO_TYPE).sha
+                operations = [
+                    CommitOperationAdd(
+                        path_in_repo=path_in_repo, path_or_fileobj=source
+                    )
+                    for path_in_repo, source in files
+                ]
+
+                if rows:
+                    index_df = _read_index_at_revision(hf_api, head)
+                    # Rows already in the index win, a product is never added twice
+                    index_df = pd.concat([index_df, new_df], ignore_index=True)
+                    index_df = index_df.drop_duplicates(subset="product", keep="first")
+
+                    write_buffer = io.BytesIO()
+                    index_df.to_parquet(write_buffer, index=False)
+                    operations.append(
+                        CommitOperationAdd(
+                            path_in_repo=INDEX_FILENAME,
+                            path_or_fileobj=write_buffer.getvalue(),
+                        )
+                    )
+
+                try:
+                    commit_info = hf_api.create_commit(
+                        repo_id=REPO_ID,
+                        repo_type=REPO_TYPE,
+                        operations=operations,
+                        commit_message=f"Add {len(rows)} products",
+                        parent_commit=head,
+                    )
+                    break
+                except HfHubHTTPError as e:
+                    conflict = e.response is not None and e.response.status_code in (
+                        409,
+                        412,
+                    )
+                    if not conflict or attempt == self.max_attempts:
+                        raise
+                    print(f"Dataset changed remotely, retrying commit ({attempt})")
+
+        with self._lock:
+            self.files = self.files[len(files) :]
+            self.rows = self.rows[len(rows) :]
+        if rows:
+            # The index we just committed is the latest, no need to download it again
+            get_cached_geojson_index_loader().update(index_df, commit_info.oid)
+        print(f"Committed {len(files)} files and {len(rows)} index rows")
+
+
+class LocalHfApi:
+    """
+    Stand-in for HfApi backed by a local folder, used to run the tool offline.
+    Only the methods used by this module are implemented. Enabled by setting
+    hf_local_dataset_dir in the environment.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._head_path = self.root / ".head"
+        self._lock = FileLock(str(self.root / ".lock"))
+
+    def _head(self):
+        if not self._head_path.exists():
+            return "0" * 40
+        return self._head_path.read_text()
+
+    def repo_info(self, repo_id, repo_type=None, **kwargs):
+        return SimpleNamespace(id=repo_id, sha=self._head())
 
+    def hf_hub_download(
+        self, repo_id, filename, repo_type=None, subfolder=None, **kwargs
+    ):
+        path = self.root / subfolder / filename if subfolder else self.root / filename
+        if not path.exists():
+            response = requests.Response()
+            response.status_code = 404
+            raise EntryNotFoundError(f"{filename} not found in {self.root}", response)
+        return str(path)
 
-def update_geojson_index_df(index_df: pd.DataFrame):
-    hf_api = get_hf_api()
+    def create_commit(
+        self,
+        repo_id,
+        operations,
+        commit_message=None,
+        repo_type=None,
+        parent_commit=None,
+        **kwargs,
+    ):
+        with self._lock:
+            if parent_commit is not None and parent_commit != self._head():
+                response = requests.Response()
+                response.status_code = 412
+                raise HfHubHTTPError("Parent commit is not the head", response=response)
 
-    write_buffer = io.BytesIO()
-    index_df.to_parquet(write_buffer, index=False)
+            for operation in operations:
+                path = self.root / operation.path_in_repo
+                path.parent.mkdir(parents=True, exist_ok=True)
+                with operation.as_file() as f, open(path, "wb") as out:
+                    shutil.copyfileobj(f, out)
 
-    hf_api.upload_file(
-        path_or_fileobj=write_buffer,
-        path_in_repo="index.parquet",
-        repo_id="rodekruis/flood-mapping",
-        repo_type="dataset",
-    )
-    get_geojson_index_df.clear()
+            head = uuid.uuid4().hex + "0" * 8
+            self._head_path.write_text(head)
+        print(f"Local commit: {commit_message}")
+        return SimpleNamespace(oid=head)
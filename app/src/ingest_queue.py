@@ -0,0 +1,230 @@
+"""Persistent queue of product downloads processed by background workers."""
+
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import streamlit as st
+
+from src import hf_utils
+from src.config_parameters import params
+from src.gfm import get_cached_gfm_handler
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class IngestQueue:
+    """
+    Product download jobs stored in a sqlite database, so they survive page reloads and
+    restarts. Jobs are keyed by product_id: a product that is already queued, running or
+    done is never submitted twice, also not from different sessions or processes.
+    A running job is leased for lease_seconds, its updated_at is the start of the lease.
+    """
+
+    def __init__(self, db_path, lease_seconds):
+        self.db_path = Path(db_path)
+        self.lease_seconds = lease_seconds
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.job_submitted = threading.Event()
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    product_id TEXT PRIMARY KEY,
+                    area_id TEXT NOT NULL,
+                    product TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+
+    @contextmanager
+    def _connect(self):
+        # Autocommit mode, write transactions are started explicitly with BEGIN IMMEDIATE
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def submit(self, area_id, product):
+        """Queue a download, failed jobs are queued again, other existing jobs are left as is"""
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO jobs (product_id, area_id, product, status, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (product_id) DO UPDATE
+                SET status = excluded.status, error = NULL, updated_at = excluded.updated_at
+                WHERE jobs.status = ?
+                """,
+                (
+                    product["product_id"],
+                    area_id,
+                    json.dumps(product),
+                    QUEUED,
+                    time.time(),
+                    FAILED,
+                ),
+            )
+        self.job_submitted.set()
+        return product["product_id"]
+
+    def claim(self, limit):
+        """
+        Mark up to limit queued jobs as running and return them,
+        running jobs with an expired lease are queued again first
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "UPDATE jobs SET status = ? WHERE status = ? AND updated_at < ?",
+                (QUEUED, RUNNING, time.time() - self.lease_seconds),
+            )
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY updated_at LIMIT ?",
+                (QUEUED, limit),
+            ).fetchall()
+            conn.executemany(
+                """
+                UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ?
+                WHERE product_id = ?
+                """,
+                [(RUNNING, time.time(), row["product_id"]) for row in rows],
+            )
+            conn.execute("COMMIT")
+        return [
+            {"area_id": row["area_id"], "product": json.loads(row["product"])}
+            for row in rows
+        ]
+
+    def complete(self, product_id, error=None):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE product_id = ?",
+                (
+                    FAILED if error else DONE,
+                    str(error) if error else None,
+                    time.time(),
+                    product_id,
+                ),
+            )
+
+    def renew_leases(self, product_ids):
+        """Extend the lease of running jobs, called by the worker while it processes them"""
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE jobs SET updated_at = ? WHERE product_id = ? AND status = ?",
+                [(time.time(), product_id, RUNNING) for product_id in product_ids],
+            )
+
+    def status(self, product_ids):
+        """Dict of product_id -> job with status, error and product"""
+        if not product_ids:
+            return {}
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT * FROM jobs WHERE product_id IN ({','.join('?' * len(product_ids))})",
+                list(product_ids),
+            ).fetchall()
+        return {
+            row["product_id"]: {
+                "status": row["status"],
+                "error": row["error"],
+                "product": json.loads(row["product"]),
+            }
+            for row in rows
+        }
+
+
+class IngestWorker(threading.Thread):
+    """Background thread that downloads claimed jobs in batches, one dataset commit per batch"""
+
+    def __init__(self, ingest_queue: IngestQueue, gfm, batch_size, poll_interval):
+        super().__init__(daemon=True)
+        self.ingest_queue = ingest_queue
+        self.gfm = gfm
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+
+    def run(self):
+        while True:
+            try:
+                jobs = self.ingest_queue.claim(self.batch_size)
+            except sqlite3.Error as e:
+                print(f"Claiming ingest jobs failed: {e}")
+                jobs = []
+            if not jobs:
+                self.ingest_queue.job_submitted.wait(self.poll_interval)
+                self.ingest_queue.job_submitted.clear()
+                continue
+
+            # Keep the lease of the jobs while processing them, if this thread or
+            # process stops the lease expires and the jobs are claimed again
+            processed = threading.Event()
+            product_ids = [job["product"]["product_id"] for job in jobs]
+            threading.Thread(
+                target=self._renew_leases,
+                args=(product_ids, processed),
+                daemon=True,
+            ).start()
+            try:
+                self.process(jobs)
+            except Exception as e:
+                # Jobs that were not completed are claimed again once their lease expires
+                print(f"Processing ingest jobs failed: {e}")
+            finally:
+                processed.set()
+
+    def _renew_leases(self, product_ids, processed: threading.Event):
+        while not processed.wait(self.ingest_queue.lease_seconds / 3):
+            try:
+                self.ingest_queue.renew_leases(product_ids)
+            except sqlite3.Error as e:
+                print(f"Renewing ingest job leases failed: {e}")
+
+    def process(self, jobs):
+        geojson_index = hf_utils.get_geojson_index()
+        products_per_area = {}
+        for job in jobs:
+            product = job["product"]
+            # Could have been ingested by another process in the meantime
+            if product["product_id"] in geojson_index:
+                self.ingest_queue.complete(product["product_id"])
+                continue
+            products_per_area.setdefault(job["area_id"], []).append(product)
+
+        for area_id, products in products_per_area.items():
+            try:
+                errors = self.gfm.download_flood_products(area_id, products)
+            except Exception as e:
+                # The commit failed, none of the products were ingested
+                errors = {p["product_id"]: e for p in products}
+            for product_id, error in errors.items():
+                self.ingest_queue.complete(product_id, error)
+
+
+@st.cache_resource
+def get_cached_ingest_queue():
+    """The ingest queue of this process, starting its background workers on first use"""
+    ingest_queue = IngestQueue(
+        params["ingest_queue_path"], lease_seconds=params["ingest_lease_seconds"]
+    )
+    for _ in range(params["ingest_workers"]):
+        IngestWorker(
+            ingest_queue,
+            get_cached_gfm_handler(),
+            batch_size=params["ingest_batch_size"],
+            poll_interval=params["ingest_poll_interval_seconds"],
+        ).start()
+    return ingest_queue
@@ -0,0 +1,150 @@
+"""Flood and footprint layers of a time group, merged from its products once and cached."""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import geopandas as gpd
+import pandas as pd
+import shapely
+import streamlit as st
+
+from src.config_parameters import params
+from src.geoparquet import read_geoparquet, write_geodataframe
+from src.utils import get_existing_geodataframe
+
+
+def _hash(*parts):
+    return hashlib.sha1("/".join(parts).encode()).hexdigest()[:16]
+
+
+def merge_layer(gdfs):
+    """Dissolve the geometries of all GeoDataFrames into non-overlapping polygons"""
+    geometries = pd.concat([gdf.geometry for gdf in gdfs], ignore_index=True)
+    merged = shapely.union_all(shapely.make_valid(geometries.values))
+    # Kept as separate polygons, so they can still be found through a spatial index
+    return gpd.GeoDataFrame(
+        geometry=shapely.get_parts(merged), crs=gdfs[0].crs or "EPSG:4326"
+    )
+
+
+class MergedLayerCache:
+    """
+    Merged layers keyed by AOI, time group, file type and the products in the group.
+    Layers are stored on disk as GeoParquet, so they are shared by all sessions and survive
+    restarts, next to a copy simplified at each tolerance level that was requested.
+    A layer is only recomputed when the products in its group change, the layers of the
+    previous set of products are then removed.
+    The rendered geojsons of the most recently used layers are kept in memory.
+    """
+
+    def __init__(self, cache_dir, max_memory_entries):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_memory_entries = max_memory_entries
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        # One lock per layer, so a layer is merged only once when requested concurrently
+        self._layer_locks = {}
+
+    def _path(self, area_id, time_group, file_type, product_ids) -> Path:
+        group_key = _hash(area_id, str(time_group), file_type)
+        products_key = _hash(*sorted(product_ids))
+        return self.cache_dir / f"{group_key}_{products_key}.parquet"
+
+    def _layer_lock(self, path):
+        with self._lock:
+            return self._layer_locks.setdefault(path.stem, threading.Lock())
+
+    def get(self, area_id, time_group, file_type, product_ids, bbox=None):
+        """
+        Return the merged layer of the products as a GeoDataFrame,
+        with a bbox only the geometries of the products intersecting it are merged.
+        """
+        path = self._path(area_id, time_group, file_type, product_ids)
+        with self._layer_lock(path):
+            if path.exists():
+                return read_geoparquet(path)
+
+            merged = merge_layer(
+                [
+                    get_existing_geodataframe(product_id, file_type, bbox)
+                    for product_id in product_ids
+                ]
+            )
+            tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+            write_geodataframe(merged, tmp_path)
+            os.replace(tmp_path, path)
+
+            # Remove the layers of this group from before a product was added to it,
+            # simplified ones included
+            group_key = path.stem.split("_")[0]
+            for old_path in self.cache_dir.glob(f"{group_key}_*.parquet"):
+                if not old_path.name.startswith(path.stem):
+                    old_path.unlink(missing_ok=True)
+            return merged
+
+    def get_layers(self, area_id, time_group, product_ids, bbox=None):
+        """The merged flood and footprint layers, as a dict of file type -> GeoDataFrame"""
+        return {
+            file_type: self.get(area_id, time_group, file_type, product_ids, bbox)
+            for file_type in ["flood", "footprint"]
+        }
+
+    def get_simplified(
+        self, area_id, time_group, file_type, product_ids, tolerance, bbox=None
+    ):
+        """The merged layer simplified with the tolerance in degrees, stored per tolerance"""
+        path = self._path(area_id, time_group, file_type, product_ids)
+        simplified_path = path.with_name(f"{path.stem}_{tolerance:g}.parquet")
+        with self._layer_lock(simplified_path):
+            if simplified_path.exists():
+                return read_geoparquet(simplified_path)
+
+            merged = self.get(area_id, time_group, file_type, product_ids, bbox)
+            merged["geometry"] = merged.geometry.simplify(
+                tolerance, preserve_topology=True
+            )
+            simplified = merged[~merged.geometry.is_empty]
+            tmp_path = simplified_path.with_suffix(f".{threading.get_ident()}.tmp")
+            write_geodataframe(simplified, tmp_path)
+            os.replace(tmp_path, simplified_path)
+            return simplified
+
+    def get_geojson(
+        self, area_id, time_group, file_type, product_ids, bbox=None, tolerance=None
+    ):
+        """The merged layer as a geojson string, simplified with the tolerance in degrees"""
+        key = (
+            self._path(area_id, time_group, file_type, product_ids).stem,
+            tolerance,
+        )
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+
+        if tolerance is None:
+            merged = self.get(area_id, time_group, file_type, product_ids, bbox)
+        else:
+            merged = self.get_simplified(
+                area_id, time_group, file_type, product_ids, tolerance, bbox
+            )
+        geojson = merged.to_json(drop_id=True)
+
+        with self._lock:
+            self._memory[key] = geojson
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+        return geojson
+
+
+@st.cache_resource
+def get_cached_merged_layer_cache():
+    return MergedLayerCache(
+        cache_dir=params["merged_layer_cache_dir"],
+        max_memory_entries=params["merged_layer_memory_entries"],
+    )
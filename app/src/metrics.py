@@ -0,0 +1,146 @@
+"""
+Timings and byte counts of the hot paths, exportable in the Prometheus text format.
+Only recorded when metrics_enabled is set, otherwise span() returns a shared no-op
+context manager and count_bytes() returns right away.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+
+from src.config_parameters import params
+
+METRIC_PREFIX = "floodmap"
+# Upper bounds in seconds of the histogram buckets of span durations
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_NOOP_SPAN = nullcontext()
+
+
+class MetricsRegistry:
+    """
+    Duration histograms and byte counters, keyed by name and labels. Components that
+    keep their own counters, like the product cache, register a collector that is read
+    on every export.
+    """
+
+    def __init__(self):
+        self._durations = {}
+        self._bytes = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register_collector(self, collect):
+        """collect() returns a list of (name, type, value) with type counter or gauge"""
+        with self._lock:
+            self._collectors.append(collect)
+
+    def collect(self):
+        """Current values of all registered collectors, as a list of (name, type, value)"""
+        with self._lock:
+            collectors = list(self._collectors)
+        return [metric for collect in collectors for metric in collect()]
+
+    def observe_duration(self, name, labels, seconds):
+        key = (name, labels)
+        bucket = bisect_left(DURATION_BUCKETS, seconds)
+        with self._lock:
+            histogram = self._durations.get(key)
+            if histogram is None:
+                histogram = self._durations[key] = {
+                    "buckets": [0] * (len(DURATION_BUCKETS) + 1),
+                    "count": 0,
+                    "sum": 0.0,
+                }
+            histogram["buckets"][bucket] += 1
+            histogram["count"] += 1
+            histogram["sum"] += seconds
+
+    def add_bytes(self, name, labels, n_bytes):
+        key = (name, labels)
+        with self._lock:
+            self._bytes[key] = self._bytes.get(key, 0) + n_bytes
+
+    def snapshot(self):
+        """Copy of the durations and byte counts, as dicts keyed by (name, labels)"""
+        with self._lock:
+            durations = {
+                key: {**histogram, "buckets": list(histogram["buckets"])}
+                for key, histogram in self._durations.items()
+            }
+            return durations, dict(self._bytes)
+
+    def reset(self):
+        with self._lock:
+            self._durations.clear()
+            self._bytes.clear()
+
+    def to_prometheus(self):
+        """All metrics in the Prometheus text exposition format"""
+        durations, byte_counts = self.snapshot()
+        lines = []
+        for name in sorted({name for name, _ in durations}):
+            metric = f"{METRIC_PREFIX}_{name}_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            for (key_name, labels), histogram in sorted(durations.items()):
+                if key_name != name:
+                    continue
+                cumulative = 0
+                for upper_bound, count in zip(
+                    [*DURATION_BUCKETS, "+Inf"], histogram["buckets"]
+                ):
+                    cumulative += count
+                    bucket_labels = _format_labels((*labels, ("le", str(upper_bound))))
+                    lines.append(f"{metric}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{metric}_sum{_format_labels(labels)} {histogram['sum']}")
+                lines.append(
+                    f"{metric}_count{_format_labels(labels)} {histogram['count']}"
+                )
+        for name in sorted({name for name, _ in byte_counts}):
+            metric = f"{METRIC_PREFIX}_{name}_bytes_total"
+            lines.append(f"# TYPE {metric} counter")
+            for (key_name, labels), n_bytes in sorted(byte_counts.items()):
+                if key_name == name:
+                    lines.append(f"{metric}{_format_labels(labels)} {n_bytes}")
+        for name, metric_type, value in self.collect():
+            metric = f"{METRIC_PREFIX}_{name}"
+            lines.append(f"# TYPE {metric} {metric_type}")
+            lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+registry = MetricsRegistry()
+
+
+@contextmanager
+def _span(name, labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe_duration(name, labels, time.perf_counter() - start)
+
+
+def span(name, **labels):
+    """Context manager recording the duration of its block under name and labels"""
+    if not params["metrics_enabled"]:
+        return _NOOP_SPAN
+    return _span(name, tuple(sorted(labels.items())))
+
+
+def count_bytes(name, n_bytes, **labels):
+    """Add n_bytes to the byte counter of name and labels"""
+    if not params["metrics_enabled"]:
+        return
+    registry.add_bytes(name, tuple(sorted(labels.items())), n_bytes)
@@ -0,0 +1,117 @@
+"""
+Scheduler that polls GFM for new products of watched AOIs and ingests them ahead of time,
+so they are already available when the Flood Analysis page is opened. Run from the
+repository root, e.g.:
+
+    PYTHONPATH=app python -m src.prefetch --aoi <aoi id> --interval-minutes 10
+
+The watched AOIs default to prefetch_watched_aois in the config parameters.
+"""
+
+import argparse
+import threading
+import time
+from datetime import date, timedelta
+
+from src import hf_utils
+from src.config_parameters import params
+from src.gfm import get_cached_gfm_handler
+from src.ingest_queue import DONE, FAILED, get_cached_ingest_queue
+
+
+class Prefetcher:
+    """Submits the products of the watched AOIs that are not in the index to the ingest queue"""
+
+    def __init__(self, gfm, ingest_queue, area_ids, lookback_days):
+        self.gfm = gfm
+        self.ingest_queue = ingest_queue
+        self.area_ids = area_ids
+        self.lookback_days = lookback_days
+
+    def run_once(self):
+        """Look for new products once and return the product_ids that were submitted"""
+        # The end of the range is exclusive, so it is the start of tomorrow
+        to_date = date.today() + timedelta(days=1)
+        from_date = to_date - timedelta(days=self.lookback_days + 1)
+
+        submitted = []
+        for area_id in self.area_ids:
+            try:
+                product_groups = self.gfm.get_area_products(area_id, from_date, to_date)
+            except Exception as e:
+                print(f"Prefetch of AOI {area_id} failed: {e}")
+                continue
+            geojson_index = hf_utils.get_geojson_index()
+            for products_in_group in product_groups.values():
+                for product in products_in_group:
+                    if product["product_id"] not in geojson_index:
+                        submitted.append(self.ingest_queue.submit(area_id, product))
+        print(f"Prefetch submitted {len(submitted)} products")
+        return submitted
+
+    def run(self, interval_seconds, stop_event=None):
+        """Look for new products every interval_seconds until stop_event is set"""
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            started_at = time.monotonic()
+            self.run_once()
+            stop_event.wait(interval_seconds - (time.monotonic() - started_at))
+
+    def wait_until_ingested(self, product_ids, poll_interval=1):
+        """Block until the submitted products are ingested or failed"""
+        while True:
+            statuses = self.ingest_queue.status(product_ids)
+            if all(job["status"] in (DONE, FAILED) for job in statuses.values()):
+                return statuses
+            time.sleep(poll_interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Ingest new GFM products of watched AOIs ahead of time"
+    )
+    parser.add_argument(
+        "--aoi",
+        action="append",
+        help="AOI id to watch, can be repeated (default: prefetch_watched_aois)",
+    )
+    parser.add_argument(
+        "--interval-minutes",
+        type=float,
+        default=params["prefetch_interval_minutes"],
+    )
+    parser.add_argument(
+        "--lookback-days", type=int, default=params["prefetch_lookback_days"]
+    )
+    parser.add_argument(
+        "--once",
+        action="store_true",
+        help="Look for new products once and wait until they are ingested",
+    )
+    args = parser.parse_args(argv)
+
+    area_ids = args.aoi or params["prefetch_watched_aois"]
+    if not area_ids:
+        parser.error("no AOIs to watch, use --aoi or set prefetch_watched_aois")
+
+    # The ingest workers run in this process and download the submitted products
+    prefetcher = Prefetcher(
+        get_cached_gfm_handler(),
+        get_cached_ingest_queue(),
+        area_ids,
+        args.lookback_days,
+    )
+    if args.once:
+        statuses = prefetcher.wait_until_ingested(prefetcher.run_once())
+        failed = [pid for pid, job in statuses.items() if job["status"] == FAILED]
+        for product_id in failed:
+            print(f"Failed: {product_id}: {statuses[product_id]['error']}")
+        return 1 if failed else 0
+
+    print(f"Watching {len(area_ids)} AOIs every {args.interval_minutes} minutes")
+    prefetcher.run(args.interval_minutes * 60)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
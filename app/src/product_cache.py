@@ -0,0 +1,188 @@
+"""Two level cache for product files: parsed geojsons in memory and files on disk."""
+
+import json
+import os
+import threading
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable
+
+import streamlit as st
+
+from src import metrics
+from src.config_parameters import params
+
+
+# Parsed geojsons take several times the size of their text in memory, mostly for the
+# float and list objects of the coordinates. Measured at about 6.5 for compact geojson
+PARSED_SIZE_FACTOR = 7
+
+
+class ProductCache:
+    """
+    Cache of product files keyed by product_id and file type.
+    Level 1 keeps parsed geojsons in memory in LRU order, bounded by their estimated size
+    in memory of PARSED_SIZE_FACTOR times their file size.
+    Level 2 keeps the files on disk, bounded by max_disk_bytes, evicting the least recently used.
+    Files that are being fetched or read are never evicted.
+    """
+
+    def __init__(self, cache_dir, max_memory_bytes, max_disk_bytes):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = sum(p.stat().st_size for p in self._disk_files())
+        self._lock = threading.Lock()
+        # One lock per file, so concurrent misses fetch a file only once
+        self._path_locks = {}
+        # Number of readers per file, files in use are skipped by the disk eviction
+        self._in_use = Counter()
+        self.counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+        }
+
+    def _disk_files(self):
+        return (p for p in self.cache_dir.iterdir() if p.suffix != ".tmp")
+
+    def _disk_path(self, product_id, file_type, suffix) -> Path:
+        return self.cache_dir / f"{product_id}_{file_type}{suffix}"
+
+    @contextmanager
+    def _use_path(self, product_id, file_type, fetch, suffix):
+        """
+        Yield the path of the file in the disk store, fetch(dest_path) is called on a miss
+        and should write the file to dest_path. The file is not evicted while in use.
+        """
+        path = self._disk_path(product_id, file_type, suffix)
+        with self._lock:
+            path_lock = self._path_locks.setdefault(path, threading.Lock())
+            self._in_use[path] += 1
+        try:
+            with path_lock:
+                if path.exists():
+                    with self._lock:
+                        self.counters["disk_hits"] += 1
+                    # Mark as recently used for the disk eviction order
+                    os.utime(path)
+                else:
+                    with self._lock:
+                        self.counters["misses"] += 1
+                    tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+                    fetch(tmp_path)
+                    os.replace(tmp_path, path)
+                    with self._lock:
+                        self._disk_bytes += path.stat().st_size
+                        self._evict_disk()
+            yield path
+        finally:
+            with self._lock:
+                self._in_use[path] -= 1
+                if not self._in_use[path]:
+                    del self._in_use[path]
+
+    def read(
+        self,
+        product_id,
+        file_type,
+        fetch: Callable[[Path], None],
+        read: Callable[[Path], Any],
+        suffix=".geojson",
+    ):
+        """Return read(path) of the file in the disk store, fetching it on a miss"""
+        with self._use_path(product_id, file_type, fetch, suffix) as path:
+            return read(path)
+
+    def get(self, product_id, file_type, fetch: Callable[[Path], None]):
+        """
+        Return the parsed geojson, fetch(dest_path) is called on a miss and should write
+        the geojson file to dest_path.
+        """
+        key = (product_id, file_type)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return self._memory[key][0]
+
+        with self._use_path(product_id, file_type, fetch, ".geojson") as path:
+            size = path.stat().st_size * PARSED_SIZE_FACTOR
+            with metrics.span("geojson_parse"), open(path, "r") as f:
+                geojson_data = json.load(f)
+
+        with self._lock:
+            if key not in self._memory and size <= self.max_memory_bytes:
+                self._memory[key] = (geojson_data, size)
+                self._memory_bytes += size
+                self._evict_memory()
+
+        return geojson_data
+
+    def _evict_memory(self):
+        while self._memory_bytes > self.max_memory_bytes:
+            _, (_, size) = self._memory.popitem(last=False)
+            self._memory_bytes -= size
+            self.counters["memory_evictions"] += 1
+
+    def _evict_disk(self):
+        if self._disk_bytes <= self.max_disk_bytes:
+            return
+        for path in sorted(self._disk_files(), key=lambda p: p.stat().st_mtime):
+            if self._disk_bytes <= self.max_disk_bytes:
+                break
+            if self._in_use[path]:
+                continue
+            size = path.stat().st_size
+            path.unlink(missing_ok=True)
+            self._disk_bytes -= size
+            self._path_locks.pop(path, None)
+            self.counters["disk_evictions"] += 1
+
+    def clear(self, disk=True):
+        """Empty the memory level, and the disk level unless disk is False"""
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            if disk:
+                for path in list(self._disk_files()):
+                    if not self._in_use[path]:
+                        self._disk_bytes -= path.stat().st_size
+                        path.unlink(missing_ok=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self.counters,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_bytes": self._disk_bytes,
+            }
+
+    def collect_metrics(self):
+        """The stats as (name, type, value), collected by the metrics registry"""
+        collected = []
+        for name, value in self.stats().items():
+            if name in self.counters:
+                collected.append((f"product_cache_{name}_total", "counter", value))
+            else:
+                collected.append((f"product_cache_{name}", "gauge", value))
+        return collected
+
+
+@st.cache_resource
+def get_cached_product_cache():
+    product_cache = ProductCache(
+        cache_dir=params["product_cache_dir"],
+        max_memory_bytes=params["product_cache_memory_mb"] * 1024 * 1024,
+        max_disk_bytes=params["product_cache_disk_mb"] * 1024 * 1024,
+    )
+    metrics.registry.register_collector(product_cache.collect_metrics)
+    return product_cache
@@ -0,0 +1,117 @@
+"""Cache of GFM product listings per AOI that only fetches date ranges not seen before."""
+
+import threading
+from datetime import date, datetime, timedelta, timezone
+
+import streamlit as st
+
+from src.config_parameters import params
+
+
+class ProductListingCache:
+    """
+    Keeps, per AOI, the date intervals that were already fetched from GFM together with the
+    products found in them. A query only fetches the sub-ranges that are not covered yet.
+    New Sentinel-1 products keep showing up for the last days, so intervals that reach into
+    the last recent_days expire after recent_ttl, older intervals after ttl.
+    """
+
+    def __init__(self, recent_days, recent_ttl, ttl):
+        self.recent_days = recent_days
+        self.recent_ttl = recent_ttl
+        self.ttl = ttl
+        # aoi_id -> list of intervals {"start", "end", "fetched_at", "products"}
+        self._intervals = {}
+        self._lock = threading.Lock()
+
+    def _is_expired(self, interval, now):
+        recent_start = now.date() - timedelta(days=self.recent_days)
+        ttl = self.recent_ttl if interval["end"] > recent_start else self.ttl
+        return now - interval["fetched_at"] > ttl
+
+    def _covered_intervals(self, area_id, now):
+        with self._lock:
+            intervals = [
+                interval
+                for interval in self._intervals.get(area_id, [])
+                if not self._is_expired(interval, now)
+            ]
+            self._intervals[area_id] = intervals
+        return intervals
+
+    @staticmethod
+    def _uncovered_ranges(intervals, from_date, to_date):
+        uncovered = []
+        current = from_date
+        for interval in sorted(intervals, key=lambda i: i["start"]):
+            if interval["end"] <= current or interval["start"] >= to_date:
+                continue
+            if interval["start"] > current:
+                uncovered.append((current, interval["start"]))
+            current = max(current, interval["end"])
+        if current < to_date:
+            uncovered.append((current, to_date))
+        return uncovered
+
+    def iter_products(self, gfm, area_id, from_date: date, to_date: date, window_days):
+        """
+        Yield lists of products for the AOI in the date range, first the cached ones and
+        then those of each window fetched from GFM for the uncovered sub-ranges.
+        """
+        now = datetime.now(timezone.utc)
+        intervals = self._covered_intervals(area_id, now)
+
+        seen_product_ids = set()
+
+        def new_products(products):
+            result = []
+            for p in products:
+                product_date = date.fromisoformat(p["product_time"][:10])
+                if from_date <= product_date < to_date and (
+                    p["product_id"] not in seen_product_ids
+                ):
+                    seen_product_ids.add(p["product_id"])
+                    # Cached products are shared between sessions, callers get copies
+                    result.append(dict(p))
+            return result
+
+        yield new_products(
+            p for interval in intervals for p in interval["products"].values()
+        )
+
+        for start, end in self._uncovered_ranges(intervals, from_date, to_date):
+            print(f"Fetching uncovered products for {area_id} from {start} to {end}")
+            interval_products = {}
+            for window_products in gfm.iter_area_products(
+                area_id, start, end, window_days=window_days
+            ):
+                interval_products.update((p["product_id"], p) for p in window_products)
+                yield new_products(window_products)
+
+            # Only stored once the whole sub-range was fetched
+            with self._lock:
+                self._intervals.setdefault(area_id, []).append(
+                    {
+                        "start": start,
+                        "end": end,
+                        "fetched_at": now,
+                        "products": interval_products,
+                    }
+                )
+
+    def invalidate(self, area_id=None):
+        """Forget the listings of the AOI, or of all AOIs"""
+        with self._lock:
+            if area_id is None:
+                self._intervals.clear()
+            else:
+                self._intervals.pop(area_id, None)
+
+
+@st.cache_resource
+def get_cached_product_listing_cache():
+    return ProductListingCache(
+        recent_days=params["product_listing_recent_days"],
+        recent_ttl=timedelta(minutes=params["product_listing_recent_ttl_minutes"]),
+        ttl=timedelta(hours=params["product_listing_ttl_hours"]),
+    )
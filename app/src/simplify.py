@@ -0,0 +1,22 @@
+"""Simplification of flood geometries for rendering at different map extents."""
+
+from shapely.geometry import shape
+
+from src.config_parameters import params
+
+
+def choose_simplify_tolerance(aoi_geojson, map_width_px=800):
+    """
+    Coarsest tolerance in degrees that is still below the size of a pixel
+    when the AOI fills the map, None if the original geometry should be used.
+    """
+    geometry = aoi_geojson.get("geometry", aoi_geojson)
+    min_x, min_y, max_x, max_y = shape(geometry).bounds
+    degrees_per_pixel = max(max_x - min_x, max_y - min_y) / map_width_px
+
+    tolerances = [
+        tolerance
+        for tolerance in params["flood_simplify_tolerances"]
+        if tolerance <= degrees_per_pixel
+    ]
+    return max(tolerances, default=None)
@@ -1,13 +1,20 @@
 """Functions for the layout of the Streamlit app, including the sidebar."""
 
-import json
 import os
+import shutil
+import tempfile
+from functools import partial
 from typing import Literal
 
+import geopandas as gpd
+import pandas as pd
 import streamlit as st
+from shapely.geometry import shape
 
-from src import hf_utils
+from src import hf_utils, metrics
 from src.config_parameters import params
+from src.geoparquet import filter_bbox, read_geoparquet
+from src.product_cache import get_cached_product_cache
 
 
 def get_aoi_id_from_selector_preview(all_aois, name):
@@ -16,6 +23,12 @@ def get_aoi_id_from_selector_preview(all_aois, name):
             return aoi_id
 
 
+def get_aoi_bounds(aoi):
+    """Bounds (min_x, min_y, max_x, max_y) of an AOI from get_cached_aois"""
+    geometry = aoi["bbox"].get("geometry", aoi["bbox"])
+    return shape(geometry).bounds
+
+
 # Check if app is deployed
 def is_app_on_streamlit():
     """Check whether the app is on streamlit or runs locally."""
@@ -166,23 +179,57 @@ def add_about():
 
 def get_existing_geojson(product_id, file_type: Literal["flood", "footprint"]):
     """
-    Getting a saved GFM flood geojson in an output folder of GFM files. Merge in one feature group if multiple.
+    Getting a saved GFM flood geojson from the product cache, downloading it from the dataset on a miss.
+    The returned geojson is shared between reruns and sessions, it should not be modified.
     """
-    index_df = hf_utils.get_geojson_index_df()
-    path_in_repo = index_df[index_df["product"] == product_id][
-        f"{file_type}_geojson_path"
-    ].values[0]
+    index_row = hf_utils.get_geojson_index().get(product_id)
+    path_in_repo = index_row[f"{file_type}_geojson_path"]
 
-    hf_api = hf_utils.get_hf_api()
-    subfolder, filename = path_in_repo.split("/")
-    geojson_path = hf_api.hf_hub_download(
-        repo_id="rodekruis/flood-mapping",
-        filename=filename,
-        repo_type="dataset",
-        subfolder=subfolder,
+    product_cache = get_cached_product_cache()
+    with metrics.span("get_existing_geojson", file_type=file_type):
+        return product_cache.get(
+            product_id, file_type, partial(_download_file, path_in_repo)
+        )
+
+
+def get_existing_geodataframe(
+    product_id, file_type: Literal["flood", "footprint"], bbox=None
+):
+    """
+    Getting a saved GFM product as a GeoDataFrame, read from its GeoParquet copy when the
+    product has one, otherwise from its geojson.
+    With a bbox (min_x, min_y, max_x, max_y) only the geometries intersecting it are returned.
+    The whole file is still downloaded once into the product cache, the bbox saves parsing
+    and memory, not the transfer.
+    """
+    index_row = hf_utils.get_geojson_index().get(product_id)
+    path_in_repo = index_row.get(f"{file_type}_geoparquet_path")
+    if pd.isna(path_in_repo):
+        geojson = get_existing_geojson(product_id, file_type)
+        gdf = gpd.GeoDataFrame.from_features(geojson["features"], crs="EPSG:4326")
+        return gdf if bbox is None else filter_bbox(gdf, bbox)
+
+    product_cache = get_cached_product_cache()
+    return product_cache.read(
+        product_id,
+        file_type,
+        partial(_download_file, path_in_repo),
+        partial(read_geoparquet, bbox=bbox),
+        suffix=".parquet",
     )
 
-    with open(geojson_path, "r") as f:
-        geojson_data = json.load(f)
 
-    return geojson_data
+def _download_file(path_in_repo, dest_path):
+    hf_api = hf_utils.get_hf_api()
+    subfolder, filename = path_in_repo.rsplit("/", 1)
+    # Download outside of the huggingface cache, the product cache keeps its own copy
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        local_path = hf_api.hf_hub_download(
+            repo_id=hf_utils.REPO_ID,
+            filename=filename,
+            repo_type=hf_utils.REPO_TYPE,
+            subfolder=subfolder,
+            local_dir=tmp_dir,
+        )
+        shutil.copyfile(local_path, dest_path)
+    metrics.count_bytes("hf_download", os.path.getsize(dest_path), file="product")
@@ -0,0 +1,236 @@
+"""Vector tiles of flood layers, encoded as Mapbox Vector Tiles and served by a local endpoint."""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import shapely
+import streamlit as st
+from shapely.geometry.polygon import orient
+
+from src.config_parameters import params
+
+TILE_EXTENT = 4096
+# Geometries are clipped slightly outside the tile, so no seams show at tile edges
+TILE_BUFFER = 64
+WEB_MERCATOR_HALF_WORLD = 20037508.342789244
+
+# Mapbox Vector Tile protobuf field numbers and geometry commands
+_TILE_LAYERS = 3
+_LAYER_NAME = 1
+_LAYER_FEATURES = 2
+_LAYER_EXTENT = 5
+_LAYER_VERSION = 15
+_FEATURE_TYPE = 3
+_FEATURE_GEOMETRY = 4
+_POLYGON = 3
+_MOVE_TO = 1
+_LINE_TO = 2
+_CLOSE_PATH = 7
+
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _field(number, payload):
+    """Length delimited field"""
+    return _varint(number << 3 | 2) + _varint(len(payload)) + payload
+
+
+def _varint_field(number, value):
+    return _varint(number << 3) + _varint(value)
+
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def _command(command_id, count):
+    return command_id & 0x7 | count << 3
+
+
+def _encode_polygon(polygon, cursor):
+    """Geometry commands of a polygon in tile coordinates, cursor is updated in place"""
+    commands = []
+    rings = [polygon.exterior, *polygon.interiors]
+    for ring in rings:
+        coords = [(int(x), int(y)) for x, y in ring.coords[:-1]]
+        # Drop repeated points left after snapping to the tile grid
+        coords = [c for i, c in enumerate(coords) if i == 0 or c != coords[i - 1]]
+        if len(coords) < 3:
+            continue
+        for i, (x, y) in enumerate(coords):
+            if i == 0:
+                commands.append(_command(_MOVE_TO, 1))
+            elif i == 1:
+                commands.append(_command(_LINE_TO, len(coords) - 1))
+            commands.append(_zigzag(x - cursor[0]))
+            commands.append(_zigzag(y - cursor[1]))
+            cursor[0], cursor[1] = x, y
+        commands.append(_command(_CLOSE_PATH, 1))
+    return commands
+
+
+def encode_tile(layers):
+    """Encode a dict of layer name -> polygons in tile coordinates as a vector tile"""
+    tile = b""
+    for name, geometries in layers.items():
+        layer = _varint_field(_LAYER_VERSION, 2) + _field(_LAYER_NAME, name.encode())
+        for geometry in geometries:
+            cursor = [0, 0]
+            commands = []
+            for polygon in shapely.get_parts(geometry):
+                if isinstance(polygon, shapely.Polygon) and not polygon.is_empty:
+                    # Exterior rings need a positive area in tile coordinates
+                    commands += _encode_polygon(orient(polygon, 1.0), cursor)
+            if not commands:
+                continue
+            feature = _varint_field(_FEATURE_TYPE, _POLYGON) + _field(
+                _FEATURE_GEOMETRY, b"".join(_varint(c) for c in commands)
+            )
+            layer += _field(_LAYER_FEATURES, feature)
+        layer += _varint_field(_LAYER_EXTENT, TILE_EXTENT)
+        tile += _field(_TILE_LAYERS, layer)
+    return tile
+
+
+def tile_bounds(z, x, y):
+    """Bounds of a tile in web mercator"""
+    tile_size = 2 * WEB_MERCATOR_HALF_WORLD / 2**z
+    min_x = -WEB_MERCATOR_HALF_WORLD + x * tile_size
+    max_y = WEB_MERCATOR_HALF_WORLD - y * tile_size
+    return min_x, max_y - tile_size, min_x + tile_size, max_y
+
+
+class Tileset:
+    """Layers of polygons that are cut into vector tiles on request"""
+
+    def __init__(self, layers):
+        # Layer name -> GeoDataFrame in web mercator with its spatial index
+        self.layers = {}
+        for name, gdf in layers.items():
+            gdf = gdf.to_crs(epsg=3857)
+            # Build the spatial index up front instead of on the first tile request
+            gdf.sindex.query(shapely.box(0, 0, 0, 0))
+            self.layers[name] = gdf
+
+    def tile(self, z, x, y):
+        min_x, min_y, max_x, max_y = tile_bounds(z, x, y)
+        scale = TILE_EXTENT / (max_x - min_x)
+        buffer = TILE_BUFFER / scale
+        clip_box = (min_x - buffer, min_y - buffer, max_x + buffer, max_y + buffer)
+
+        tile_layers = {}
+        for name, gdf in self.layers.items():
+            geometries = gdf.geometry.values[gdf.sindex.query(shapely.box(*clip_box))]
+            geometries = shapely.clip_by_rect(geometries, *clip_box)
+            # To tile coordinates with y pointing down, simplified to the tile resolution
+            geometries = shapely.transform(
+                geometries,
+                lambda coords: (coords - [min_x, max_y]) * [scale, -scale],
+            )
+            geometries = shapely.simplify(geometries, 1, preserve_topology=True)
+            geometries = shapely.set_precision(geometries, 1)
+            tile_layers[name] = [g for g in geometries if not g.is_empty]
+        return encode_tile(tile_layers)
+
+
+class TileServer:
+    """
+    Local HTTP endpoint serving /<tileset key>/<z>/<x>/<y>.pbf for registered tilesets.
+    The most recently used tilesets and tiles are kept in memory.
+    """
+
+    def __init__(self, host, port, max_tilesets=32, max_tiles=2048):
+        self.max_tilesets = max_tilesets
+        self.max_tiles = max_tiles
+        self._tilesets = OrderedDict()
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.httpd = ThreadingHTTPServer((host, port), _TileRequestHandler)
+        self.httpd.tile_server = self
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        print(f"Serving vector tiles on {host}:{port}")
+
+    def register(self, name, load_layers):
+        """
+        Register a tileset under a name that identifies its content and return its key.
+        load_layers() should return a dict of layer name -> GeoDataFrame,
+        it is only called if the tileset is not registered yet.
+        """
+        key = hashlib.sha1(name.encode()).hexdigest()[:16]
+        with self._lock:
+            if key in self._tilesets:
+                self._tilesets.move_to_end(key)
+                return key
+
+        tileset = Tileset(load_layers())
+        with self._lock:
+            self._tilesets[key] = tileset
+            while len(self._tilesets) > self.max_tilesets:
+                self._tilesets.popitem(last=False)
+        return key
+
+    def get_tile(self, key, z, x, y):
+        tile_key = (key, z, x, y)
+        with self._lock:
+            if tile_key in self._tiles:
+                self._tiles.move_to_end(tile_key)
+                return self._tiles[tile_key]
+            tileset = self._tilesets.get(key)
+        if tileset is None:
+            return None
+
+        tile = tileset.tile(z, x, y)
+        with self._lock:
+            self._tiles[tile_key] = tile
+            while len(self._tiles) > self.max_tiles:
+                self._tiles.popitem(last=False)
+        return tile
+
+
+class _TileRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        try:
+            key, z, x, y = self.path.strip("/").removesuffix(".pbf").split("/")
+            tile = self.server.tile_server.get_tile(key, int(z), int(x), int(y))
+        except ValueError:
+            tile = None
+        if tile is None:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-protobuf")
+        self.send_header("Content-Length", str(len(tile)))
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(tile)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def tile_url(key):
+    return f"{params['vector_tiles_url']}/{key}/{{z}}/{{x}}/{{y}}.pbf"
+
+
+@st.cache_resource
+def get_cached_tile_server():
+    """The tile server, None if it could not be started, e.g. when the port is taken"""
+    try:
+        return TileServer(params["vector_tiles_host"], params["vector_tiles_port"])
+    except OSError as e:
+        print(f"Could not start the vector tile server, using inline geojson: {e}")
+        return None
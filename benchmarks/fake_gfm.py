@@ -0,0 +1,318 @@
+"""
+Local stand-in of the GFM API, serving generated AOIs, products and product archives.
+Covers the endpoints used by GFMHandler: /auth/login, /aoi/..., /download/product/...
+and the download links of the zip archives.
+
+Run it on its own and point the app to it with gfm_base_url=http://localhost:8000/v1:
+
+    python benchmarks/fake_gfm.py --port 8000
+"""
+
+import argparse
+import base64
+import io
+import json
+import math
+import random
+import threading
+import time
+import uuid
+import zipfile
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+API_PREFIX = "/v1"
+# Products are generated every PRODUCT_INTERVAL from FIRST_PRODUCT_TIME onwards, in passes
+# of PRODUCTS_PER_PASS products a few seconds apart like the adjacent products of a pass
+FIRST_PRODUCT_TIME = datetime(2025, 1, 1, 5, 30)
+PRODUCT_INTERVAL = timedelta(hours=12)
+PRODUCTS_PER_PASS = 2
+TOKEN_LIFETIME_SECONDS = 3600
+
+
+def fake_jwt(expires_at):
+    def encode(data):
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip("=")
+
+    return ".".join([encode({"alg": "none"}), encode({"exp": expires_at}), "signature"])
+
+
+def _polygon(rng, center_x, center_y, radius, n_vertices):
+    """Irregular polygon with n_vertices around the center"""
+    ring = []
+    for i in range(n_vertices):
+        angle = 2 * math.pi * i / n_vertices
+        r = radius * rng.uniform(0.5, 1.0)
+        ring.append(
+            [
+                round(center_x + r * math.cos(angle), 6),
+                round(center_y + r * math.sin(angle), 6),
+            ]
+        )
+    ring.append(ring[0])
+    return {"type": "Polygon", "coordinates": [ring]}
+
+
+def _feature_collection(geometries):
+    return json.dumps(
+        {
+            "type": "FeatureCollection",
+            "features": [
+                {"type": "Feature", "properties": {}, "geometry": geometry}
+                for geometry in geometries
+            ],
+        }
+    )
+
+
+class FakeGFM:
+    """
+    Generated content of the fake API. Product archives are generated deterministically
+    from the product_id, with n_features flood polygons of n_vertices each.
+    """
+
+    def __init__(self, n_aois=3, n_features=2000, n_vertices=24, latency=0.0):
+        self.n_features = n_features
+        self.n_vertices = n_vertices
+        # Seconds added to every API response, to mimic the round trip to the real API
+        self.latency = latency
+        self.user_id = "fake-user"
+        self.aois = {}
+        for i in range(n_aois):
+            self.create_aoi(f"Fake AOI {i}", self._aoi_coordinates(i))
+        self.request_counts = {}
+        # Generated archives by product_id, generating one takes longer than serving it
+        self._archives = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _aoi_coordinates(i):
+        min_x, min_y = 30 + i, 0
+        return [
+            [
+                [min_x, min_y],
+                [min_x + 0.5, min_y],
+                [min_x + 0.5, min_y + 0.5],
+                [min_x, min_y + 0.5],
+                [min_x, min_y],
+            ]
+        ]
+
+    def create_aoi(self, name, coordinates):
+        aoi_id = uuid.uuid4().hex
+        self.aois[aoi_id] = {
+            "aoi_id": aoi_id,
+            "aoi_name": name,
+            "geoJSON": {"type": "Polygon", "coordinates": coordinates},
+        }
+        return aoi_id
+
+    def count(self, endpoint):
+        with self._lock:
+            self.request_counts[endpoint] = self.request_counts.get(endpoint, 0) + 1
+
+    def products(self, aoi_id, from_time, to_time):
+        products = []
+        pass_time = FIRST_PRODUCT_TIME
+        while pass_time < to_time:
+            for i in range(PRODUCTS_PER_PASS):
+                product_time = pass_time + timedelta(seconds=25 * i)
+                if from_time <= product_time < to_time:
+                    products.append(
+                        {
+                            "product_id": f"{aoi_id[:8]}-{product_time:%Y%m%dT%H%M%S}",
+                            "product_time": product_time.strftime("%Y-%m-%dT%H:%M:%S"),
+                        }
+                    )
+            pass_time += PRODUCT_INTERVAL
+        return products
+
+    def archive(self, product_id):
+        """Zip archive of the product with its flood and footprint geojsons"""
+        with self._lock:
+            if product_id in self._archives:
+                return self._archives[product_id]
+        archive = self._generate_archive(product_id)
+        with self._lock:
+            return self._archives.setdefault(product_id, archive)
+
+    def _generate_archive(self, product_id):
+        rng = random.Random(product_id)
+        aoi = next(
+            a for a in self.aois.values() if product_id.startswith(a["aoi_id"][:8])
+        )
+        (min_x, min_y), _, (max_x, max_y) = aoi["geoJSON"]["coordinates"][0][:3]
+        radius = (max_x - min_x) / math.sqrt(self.n_features) / 2
+        floods = [
+            _polygon(
+                rng,
+                rng.uniform(min_x, max_x),
+                rng.uniform(min_y, max_y),
+                radius,
+                self.n_vertices,
+            )
+            for _ in range(self.n_features)
+        ]
+        footprint = {
+            "type": "Polygon",
+            "coordinates": [
+                [
+                    [min_x - 1, min_y - 1],
+                    [max_x + 1, min_y - 1],
+                    [max_x + 1, max_y + 1],
+                    [min_x - 1, max_y + 1],
+                    [min_x - 1, min_y - 1],
+                ]
+            ],
+        }
+
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as z:
+            z.writestr(f"{product_id}_FLOOD.geojson", _feature_collection(floods))
+            z.writestr(
+                f"{product_id}_FOOTPRINT.geojson", _feature_collection([footprint])
+            )
+            z.writestr(f"{product_id}_README.txt", "Generated by the fake GFM API")
+        return buffer.getvalue()
+
+
+class _FakeGFMRequestHandler(BaseHTTPRequestHandler):
+    @property
+    def gfm(self) -> FakeGFM:
+        return self.server.gfm
+
+    def _send_json(self, data, status=200):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self):
+        scheme, _, token = self.headers.get("Authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            self._send_json({"detail": "Not authenticated"}, 401)
+            return False
+        return True
+
+    def _api_path(self):
+        url = urlparse(self.path)
+        if self.gfm.latency and url.path.startswith(API_PREFIX):
+            time.sleep(self.gfm.latency)
+        return url.path.removeprefix(API_PREFIX).strip("/").split("/"), parse_qs(
+            url.query
+        )
+
+    def do_POST(self):
+        parts, _ = self._api_path()
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if parts == ["auth", "login"]:
+            self.gfm.count("login")
+            self._send_json(
+                {
+                    "client_id": self.gfm.user_id,
+                    "access_token": fake_jwt(time.time() + TOKEN_LIFETIME_SECONDS),
+                }
+            )
+        elif not self._authorized():
+            return
+        elif parts == ["aoi", "create"]:
+            self.gfm.count("create_aoi")
+            aoi_id = self.gfm.create_aoi(
+                body["aoi_name"], body["geoJSON"]["coordinates"]
+            )
+            self._send_json({"aoi_id": aoi_id})
+        else:
+            self.send_error(404)
+
+    def do_DELETE(self):
+        parts, _ = self._api_path()
+        if not self._authorized():
+            return
+        if parts[:3] == ["aoi", "delete", "id"]:
+            self.gfm.count("delete_aoi")
+            self.gfm.aois.pop(parts[3], None)
+            self._send_json({})
+        else:
+            self.send_error(404)
+
+    def do_GET(self):
+        parts, query = self._api_path()
+        if parts[0] == "files":
+            # Download links of the archives, these are not authenticated
+            self.gfm.count("archive")
+            body = self.gfm.archive(parts[1].removesuffix(".zip"))
+            self.send_response(200)
+            self.send_header("Content-Type", "application/zip")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if not self._authorized():
+            return
+
+        if parts[:2] == ["aoi", "user"]:
+            self.gfm.count("aois")
+            self._send_json({"aois": list(self.gfm.aois.values())})
+        elif parts[0] == "aoi" and parts[2:] == ["products"]:
+            self.gfm.count("products")
+            products = self.gfm.products(
+                parts[1],
+                datetime.fromisoformat(query["from"][0]),
+                datetime.fromisoformat(query["to"][0]),
+            )
+            self._send_json({"products": products})
+        elif parts[:2] == ["download", "product"]:
+            self.gfm.count("download")
+            host, port = self.server.server_address[:2]
+            self._send_json(
+                {"download_link": f"http://{host}:{port}/files/{parts[2]}.zip"}
+            )
+        else:
+            self.send_error(404)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeGFMServer:
+    """The fake API served on localhost in a background thread"""
+
+    def __init__(self, gfm: FakeGFM, port=0):
+        self.gfm = gfm
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), _FakeGFMRequestHandler)
+        self.httpd.gfm = gfm
+        self.port = self.httpd.server_address[1]
+        self.base_url = f"http://127.0.0.1:{self.port}{API_PREFIX}"
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a fake GFM API locally")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--aois", type=int, default=3)
+    parser.add_argument("--features", type=int, default=2000)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds added to API responses"
+    )
+    args = parser.parse_args()
+
+    server = FakeGFMServer(
+        FakeGFM(n_aois=args.aois, n_features=args.features, latency=args.latency),
+        port=args.port,
+    )
+    print(f"Fake GFM API on {server.base_url}")
+    server.httpd.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+"""
+End to end benchmarks of the download, index and read paths, run against the fake GFM API
+and a local folder in place of the Hugging Face dataset repo. From the repository root:
+
+    python benchmarks/run_benchmarks.py --output benchmarks.json
+
+Every benchmark records latency percentiles, throughput and the growth of the resident
+set size during a separate run, sampled from /proc so memory allocated by native code
+(GDAL, GEOS, Arrow) is included. Memory freed by earlier benchmarks and reused is not
+counted as growth. Peak memory is only measured on Linux.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+from fake_gfm import FakeGFM, FakeGFMServer
+
+APP_DIR = Path(__file__).resolve().parents[1] / "app"
+
+
+def configure_environment(work_dir, base_url):
+    """Point the app to the fake API and local folders, before src is imported"""
+    os.environ.update(
+        {
+            "gfm_base_url": base_url,
+            "gfm_username": "benchmark",
+            "gfm_password": "benchmark",
+            "hf_local_dataset_dir": str(work_dir / "dataset"),
+            "product_cache_dir": str(work_dir / "products"),
+            "merged_layer_cache_dir": str(work_dir / "merged_layers"),
+            "ingest_queue_path": str(work_dir / "ingest_queue.sqlite"),
+            "vector_tiles_enabled": "false",
+        }
+    )
+    sys.path.insert(0, str(APP_DIR))
+
+
+def _percentile(values, q):
+    if len(values) < 2:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+class RssSampler:
+    """Peak growth of the resident set size over the start, sampled in a thread"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.page_size = os.sysconf("SC_PAGE_SIZE")
+        self._stop = threading.Event()
+
+    def _rss_bytes(self):
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * self.page_size
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak_bytes = max(self.peak_bytes, self._rss_bytes())
+
+    def __enter__(self):
+        self.start_bytes = self.peak_bytes = self._rss_bytes()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak_bytes = max(self.peak_bytes, self._rss_bytes())
+
+    @property
+    def growth_bytes(self):
+        return self.peak_bytes - self.start_bytes
+
+
+def measure(name, run, runs, items_per_run=1, setup=None):
+    """
+    Time runs calls of run(i), with setup(i) called untimed before each,
+    then sample the peak memory of one more call.
+    """
+    latencies = []
+    for i in range(runs):
+        if setup:
+            setup(i)
+        start = time.perf_counter()
+        run(i)
+        latencies.append(time.perf_counter() - start)
+
+    if setup:
+        setup(runs)
+    peak_bytes = None
+    if os.path.exists("/proc/self/statm"):
+        with RssSampler() as sampler:
+            run(runs)
+        peak_bytes = sampler.growth_bytes
+    else:
+        run(runs)
+
+    result = {
+        "name": name,
+        "runs": runs,
+        "p50_ms": 1000 * _percentile(latencies, 50),
+        "p95_ms": 1000 * _percentile(latencies, 95),
+        "p99_ms": 1000 * _percentile(latencies, 99),
+        "throughput_per_s": runs * items_per_run / sum(latencies),
+        "peak_memory_mb": peak_bytes / 1024 / 1024 if peak_bytes is not None else None,
+    }
+    peak = (
+        f"{result['peak_memory_mb']:7.1f} MB" if peak_bytes is not None else "    n/a"
+    )
+    print(
+        f"{name:<40} p50 {result['p50_ms']:9.1f} ms   p95 {result['p95_ms']:9.1f} ms"
+        f"   {result['throughput_per_s']:9.1f} /s   peak {peak}"
+    )
+    return result
+
+
+def run_benchmarks(args, base_url):
+    # Imported here, the app modules read their configuration on import
+    import pandas as pd
+    from src import hf_utils
+    from src.gfm import GFMHandler
+    from src.product_cache import get_cached_product_cache
+    from src.utils import get_existing_geojson
+
+    gfm = GFMHandler(base_url=base_url)
+    area_id = next(iter(gfm.retrieve_all_aois()))
+    from_date = date(2025, 1, 1)
+    to_date = from_date + timedelta(days=args.days)
+
+    results = []
+    results.append(
+        measure(
+            "get_area_products",
+            lambda i: gfm.get_area_products(area_id, from_date, to_date),
+            runs=args.runs,
+        )
+    )
+    results.append(
+        measure(
+            "get_area_products (7 day windows)",
+            lambda i: gfm.get_area_products(area_id, from_date, to_date, window_days=7),
+            runs=args.runs,
+        )
+    )
+
+    products = [
+        product
+        for products_in_group in gfm.get_area_products(
+            area_id, from_date, to_date
+        ).values()
+        for product in products_in_group
+    ]
+    needed = 2 * (args.products + 1)
+    if len(products) < needed:
+        raise SystemExit(f"Only {len(products)} products, increase --days")
+
+    # Each run downloads products that are not in the dataset yet
+    single_products = products[: args.products + 1]
+    results.append(
+        measure(
+            "download_flood_product",
+            lambda i: gfm.download_flood_product(area_id, single_products[i]),
+            runs=args.products,
+        )
+    )
+    batch = products[args.products + 1 : needed]
+    batch_size = len(batch) // 2
+    results.append(
+        measure(
+            f"download_flood_products ({batch_size} per batch)",
+            lambda i: gfm.download_flood_products(
+                area_id, batch[i * batch_size : (i + 1) * batch_size]
+            ),
+            runs=1,
+            items_per_run=batch_size,
+        )
+    )
+
+    loader = hf_utils.get_cached_geojson_index_loader()
+
+    def forget_revision(i):
+        loader.revision = None
+
+    results.append(
+        measure(
+            f"index refresh ({len(loader.get())} rows)",
+            lambda i: loader.refresh(),
+            runs=args.runs,
+            setup=forget_revision,
+        )
+    )
+    large_index = pd.DataFrame(
+        {
+            "aoi_id": [f"aoi-{i % 50}" for i in range(args.index_rows)],
+            "datetime": ["2025-01-01T05:30:00"] * args.index_rows,
+            "product": [f"product-{i}" for i in range(args.index_rows)],
+            "flood_geojson_path": [
+                f"flood-geojson/product-{i}_FLOOD.geojson"
+                for i in range(args.index_rows)
+            ],
+        }
+    )
+    results.append(
+        measure(
+            f"index build ({args.index_rows} rows)",
+            lambda i: hf_utils.GeojsonIndex(large_index),
+            runs=args.runs,
+        )
+    )
+
+    product_cache = get_cached_product_cache()
+    product_id = single_products[0]["product_id"]
+
+    def clear_cache(i):
+        product_cache.clear()
+
+    def clear_memory(i):
+        product_cache.clear(disk=False)
+
+    def read_flood(i):
+        get_existing_geojson(product_id, "flood")
+
+    results.append(
+        measure(
+            "get_existing_geojson (cold)", read_flood, runs=args.runs, setup=clear_cache
+        )
+    )
+    results.append(
+        measure(
+            "get_existing_geojson (disk cache)",
+            read_flood,
+            runs=args.runs,
+            setup=clear_memory,
+        )
+    )
+    results.append(
+        measure("get_existing_geojson (memory cache)", read_flood, runs=args.runs)
+    )
+
+    # Commits read the index at the head, append the new rows and write it back,
+    # timed against an index grown to index_rows rows
+    with hf_utils.DatasetWriter() as dataset_writer:
+        for row in large_index.to_dict("records"):
+            dataset_writer.add_index_row(row)
+        dataset_writer.commit()
+
+    def commit_rows(i):
+        with hf_utils.DatasetWriter() as dataset_writer:
+            for j in range(args.commit_rows):
+                row = large_index.iloc[0].to_dict()
+                row["product"] = f"committed-{i}-{j}"
+                dataset_writer.add_index_row(row)
+            dataset_writer.commit()
+
+    results.append(
+        measure(
+            f"index commit ({args.commit_rows} rows into {len(loader.get())})",
+            commit_rows,
+            runs=args.runs,
+            items_per_run=args.commit_rows,
+        )
+    )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the app against a fake GFM")
+    parser.add_argument("--runs", type=int, default=10, help="Runs per benchmark")
+    parser.add_argument(
+        "--products", type=int, default=10, help="Products downloaded one by one"
+    )
+    parser.add_argument(
+        "--features", type=int, default=2000, help="Flood polygons per product"
+    )
+    parser.add_argument("--days", type=int, default=30, help="Days of products")
+    parser.add_argument("--index-rows", type=int, default=10000)
+    parser.add_argument(
+        "--commit-rows", type=int, default=10, help="Index rows added per commit"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="Seconds added to API responses"
+    )
+    parser.add_argument("--output", help="Write the results to this json file")
+    args = parser.parse_args()
+
+    server = FakeGFMServer(FakeGFM(n_features=args.features, latency=args.latency))
+    server.start()
+    work_dir = Path(tempfile.mkdtemp(prefix="flood-mapping-benchmark-"))
+    configure_environment(work_dir, server.base_url)
+    try:
+        results = run_benchmarks(args, server.base_url)
+    finally:
+        server.stop()
+        shutil.rmtree(work_dir)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"arguments": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+import pytest
+from src import hf_utils
+
+
+def _clear_cached_dataset():
+    hf_utils.get_hf_api.clear()
+    hf_utils.get_cached_geojson_index_loader.clear()
+
+
+@pytest.fixture
+def local_dataset(tmp_path, monkeypatch):
+    """A local folder in place of the Hugging Face dataset repo, with a fresh index loader"""
+    dataset_dir = tmp_path / "dataset"
+    monkeypatch.setenv("hf_local_dataset_dir", str(dataset_dir))
+    _clear_cached_dataset()
+    yield dataset_dir
+    _clear_cached_dataset()
+
+
+@pytest.fixture
+def fake_gfm_server(monkeypatch):
+    """The fake GFM API of the benchmarks, served on localhost"""
+    from fake_gfm import FakeGFM, FakeGFMServer
+
+    monkeypatch.setenv("gfm_username", "test")
+    monkeypatch.setenv("gfm_password", "test")
+    server = FakeGFMServer(FakeGFM(n_aois=2, n_features=20)).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def gfm(fake_gfm_server):
+    from src.gfm import GFMHandler
+
+    return GFMHandler(base_url=fake_gfm_server.base_url)
@@ -0,0 +1,50 @@
+import numpy as np
+import shapely
+from src.flood_composite import composite_resolution, rasterize
+
+
+def test_rasterize_marks_pixel_centers_inside_polygons():
+    geometries = [
+        shapely.box(0, 0, 2, 1),
+        # Overlapping the first one, counted once
+        shapely.box(1, 0, 2, 1),
+        shapely.box(3, 2, 4, 3),
+    ]
+
+    grid = rasterize(geometries, bounds=(0, 0, 4, 3), resolution=1)
+
+    # Rows from north to south
+    assert grid.tolist() == [
+        [False, False, False, True],
+        [False, False, False, False],
+        [True, True, False, False],
+    ]
+
+
+def test_rasterize_clips_to_bounds_and_ignores_lines():
+    geometries = [
+        shapely.box(-10, -10, 0.5, 10),
+        shapely.LineString([(0, 0), (4, 4)]),
+    ]
+
+    grid = rasterize(geometries, bounds=(0, 0, 2, 2), resolution=0.5)
+
+    assert grid.shape == (4, 4)
+    assert grid[:, 0].all()
+    assert not grid[:, 1:].any()
+
+
+def test_rasterize_multipolygon_with_hole():
+    donut = shapely.box(0, 0, 3, 3).difference(shapely.box(1, 1, 2, 2))
+
+    grid = rasterize([shapely.MultiPolygon([donut])], bounds=(0, 0, 3, 3), resolution=1)
+
+    assert grid.sum() == 8
+    assert not grid[1, 1]
+
+
+def test_composite_resolution_is_coarsened_for_large_areas():
+    assert composite_resolution((0, 0, 1, 1), 0.01, max_pixels=100**2) == 0.01
+    assert np.isclose(
+        composite_resolution((0, 0, 10, 10), 0.01, max_pixels=100**2), 0.1
+    )
@@ -0,0 +1,121 @@
+import threading
+import time
+from datetime import date, timedelta
+
+from src import hf_utils
+from src.gfm import TOKEN_REFRESH_MARGIN, group_products_by_time
+
+
+def _product(product_id, product_time):
+    return {"product_id": product_id, "product_time": product_time}
+
+
+def test_group_products_by_time_groups_products_of_one_pass():
+    products = [
+        _product("b", "2025-01-01T05:30:25"),
+        _product("c", "2025-01-01T17:30:00"),
+        _product("a", "2025-01-01T05:30:00"),
+    ]
+
+    groups = group_products_by_time(products)
+
+    assert list(groups) == ["2025-01-01T05:30:00", "2025-01-01T17:30:00"]
+    assert [p["product_id"] for p in groups["2025-01-01T05:30:00"]] == ["a", "b"]
+    assert [p["product_id"] for p in groups["2025-01-01T17:30:00"]] == ["c"]
+    assert products[0]["product_time_group"] == "2025-01-01T05:30:00"
+
+
+def test_group_products_by_time_measures_tolerance_from_first_product():
+    # 40 s apart each, but the third is more than a minute after the first of the group
+    products = [
+        _product("a", "2025-01-01T05:30:00"),
+        _product("b", "2025-01-01T05:30:40"),
+        _product("c", "2025-01-01T05:31:20"),
+    ]
+
+    groups = group_products_by_time(products, tolerance=timedelta(minutes=1))
+
+    assert {time_group: len(group) for time_group, group in groups.items()} == {
+        "2025-01-01T05:30:00": 2,
+        "2025-01-01T05:31:20": 1,
+    }
+
+
+def test_group_products_by_time_mixed_time_formats():
+    products = [
+        _product("a", "2025-01-01T05:30:00Z"),
+        _product("b", "2025-01-01T05:30:10.500000"),
+    ]
+
+    groups = group_products_by_time(products)
+
+    assert list(groups) == ["2025-01-01T05:30:00Z"]
+
+
+def test_group_products_by_time_no_products():
+    assert group_products_by_time([]) == {}
+
+
+def test_token_is_refreshed_once_before_it_expires(gfm, fake_gfm_server):
+    access_token, _ = gfm._token
+    gfm._token = (access_token, time.time() + TOKEN_REFRESH_MARGIN / 2)
+
+    threads = [threading.Thread(target=gfm.retrieve_all_aois) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # One login on creation and one shared refresh, no request was rejected first
+    assert fake_gfm_server.gfm.request_counts == {"login": 2, "aois": 8}
+    assert gfm.access_token != access_token
+
+
+def test_valid_token_is_not_refreshed(gfm, fake_gfm_server):
+    gfm.retrieve_all_aois()
+    gfm.retrieve_all_aois()
+
+    assert fake_gfm_server.gfm.request_counts["login"] == 1
+
+
+def test_download_flood_products_isolates_failing_products(
+    local_dataset, gfm, monkeypatch
+):
+    area_id = next(iter(gfm.retrieve_all_aois()))
+    products = [
+        product
+        for products_in_group in gfm.get_area_products(
+            area_id, date(2025, 1, 1), date(2025, 1, 3)
+        ).values()
+        for product in products_in_group
+    ]
+    failing_product_id = products[1]["product_id"]
+    stage_flood_product = gfm._stage_flood_product
+
+    def stage_or_fail(area_id, product, dataset_writer):
+        if product["product_id"] == failing_product_id:
+            raise RuntimeError("Corrupt archive")
+        stage_flood_product(area_id, product, dataset_writer)
+
+    monkeypatch.setattr(gfm, "_stage_flood_product", stage_or_fail)
+    progress = []
+
+    errors = gfm.download_flood_products(
+        area_id,
+        products,
+        max_workers=2,
+        progress_callback=lambda n_done, n_total, product, error: progress.append(
+            (n_done, n_total, error is None)
+        ),
+    )
+
+    assert str(errors.pop(failing_product_id)) == "Corrupt archive"
+    assert len(errors) == len(products) - 1
+    assert set(errors.values()) == {None}
+    assert sorted(n_done for n_done, _, _ in progress) == list(
+        range(1, len(products) + 1)
+    )
+    assert sum(succeeded for _, _, succeeded in progress) == len(products) - 1
+    geojson_index = hf_utils.get_geojson_index()
+    assert failing_product_id not in geojson_index
+    assert all(product_id in geojson_index for product_id in errors)
@@ -0,0 +1,162 @@
+import threading
+import time
+
+import pandas as pd
+import pytest
+from huggingface_hub import CommitOperationAdd
+from src import hf_utils
+
+# Unpatched, for the commits of the other session in the test below
+_create_commit = hf_utils.LocalHfApi.create_commit
+
+
+def _row(product_id):
+    return {
+        "aoi_id": "aoi",
+        "datetime": "2025-01-01T05:30:00",
+        "product": product_id,
+        "flood_geojson_path": f"flood-geojson/{product_id}_FLOOD.geojson",
+    }
+
+
+def _index_products(dataset_dir):
+    return sorted(pd.read_parquet(dataset_dir / hf_utils.INDEX_FILENAME)["product"])
+
+
+def _commit_index(api, rows):
+    buffer = pd.DataFrame(rows).to_parquet(index=False)
+    _create_commit(
+        api,
+        repo_id=hf_utils.REPO_ID,
+        operations=[
+            CommitOperationAdd(
+                path_in_repo=hf_utils.INDEX_FILENAME, path_or_fileobj=buffer
+            )
+        ],
+        parent_commit=api.repo_info(repo_id=hf_utils.REPO_ID).sha,
+    )
+
+
+def test_dataset_writer_commits_files_and_rows_at_once(local_dataset):
+    with hf_utils.DatasetWriter() as writer:
+        writer.add_file("flood-geojson/a_FLOOD.geojson", b"{}")
+        writer.add_index_row(_row("a"))
+        writer.commit()
+
+    assert (local_dataset / "flood-geojson" / "a_FLOOD.geojson").read_bytes() == b"{}"
+    assert _index_products(local_dataset) == ["a"]
+    assert "a" in hf_utils.get_geojson_index()
+
+
+def test_dataset_writer_merges_rows_committed_concurrently(local_dataset, monkeypatch):
+    api = hf_utils.get_hf_api()
+    _commit_index(api, [_row("existing")])
+
+    attempts = []
+
+    def create_commit_after_other_session(self, *args, **kwargs):
+        attempts.append(kwargs["parent_commit"])
+        if len(attempts) == 1:
+            # Another session commits between reading the head and committing
+            _commit_index(self, [_row("existing"), _row("concurrent")])
+        return _create_commit(self, *args, **kwargs)
+
+    monkeypatch.setattr(
+        hf_utils.LocalHfApi, "create_commit", create_commit_after_other_session
+    )
+
+    with hf_utils.DatasetWriter() as writer:
+        writer.add_index_row(_row("new"))
+        writer.add_index_row(_row("existing"))
+        writer.commit()
+
+    assert len(attempts) == 2
+    assert attempts[0] != attempts[1]
+    assert _index_products(local_dataset) == ["concurrent", "existing", "new"]
+    assert writer.rows == []
+
+
+@pytest.fixture
+def index_reads(monkeypatch):
+    """Revisions the index is downloaded at, each download taking a little while"""
+    reads = []
+    read_index_at_revision = hf_utils._read_index_at_revision
+
+    def slow_read_index_at_revision(hf_api, revision):
+        reads.append(revision)
+        time.sleep(0.05)
+        return read_index_at_revision(hf_api, revision)
+
+    monkeypatch.setattr(
+        hf_utils, "_read_index_at_revision", slow_read_index_at_revision
+    )
+    return reads
+
+
+def _wait_for_background_refresh(loader):
+    for _ in range(100):
+        with loader._lock:
+            if not loader._refreshing:
+                return
+        time.sleep(0.01)
+
+
+def test_index_loader_first_get_loads_once(local_dataset, index_reads):
+    _commit_index(hf_utils.get_hf_api(), [_row("a")])
+    loader = hf_utils.GeojsonIndexLoader(ttl_seconds=60)
+
+    threads = [threading.Thread(target=loader.get) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(index_reads) == 1
+    assert "a" in loader.get()
+
+
+def test_index_loader_revalidates_in_background(local_dataset, index_reads):
+    api = hf_utils.get_hf_api()
+    _commit_index(api, [_row("a")])
+    loader = hf_utils.GeojsonIndexLoader(ttl_seconds=0)
+    loader.get()
+
+    # Stale but unchanged, revalidated without downloading the index again
+    loader.get()
+    _wait_for_background_refresh(loader)
+    assert len(index_reads) == 1
+
+    _commit_index(api, [_row("a"), _row("b")])
+    # The stale index is returned right away, the new one once it is loaded
+    assert "b" not in loader.get()
+    _wait_for_background_refresh(loader)
+    assert "b" in loader.get()
+    assert index_reads[-1] == loader.revision == api.repo_info(repo_id=None).sha
+
+
+def test_index_loader_update_never_replaces_a_newer_index(local_dataset):
+    api = hf_utils.get_hf_api()
+    _commit_index(api, [_row("a")])
+    committed_revision = api.repo_info(repo_id=None).sha
+    # Another session commits before this process installs its committed index
+    _commit_index(api, [_row("a"), _row("b")])
+    loader = hf_utils.GeojsonIndexLoader(ttl_seconds=60)
+    loader.get()
+
+    loader.update(pd.DataFrame([_row("a")]), committed_revision)
+
+    assert "b" in loader.get()
+    assert loader.revision == api.repo_info(repo_id=None).sha
+
+
+def test_index_loader_update_installs_the_head(local_dataset, index_reads):
+    api = hf_utils.get_hf_api()
+    _commit_index(api, [_row("a")])
+    loader = hf_utils.GeojsonIndexLoader(ttl_seconds=60)
+    loader.get()
+
+    _commit_index(api, [_row("a"), _row("b")])
+    loader.update(pd.DataFrame([_row("a"), _row("b")]), api.repo_info(repo_id=None).sha)
+
+    assert "b" in loader.get()
+    assert len(index_reads) == 1
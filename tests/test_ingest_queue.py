@@ -0,0 +1,57 @@
+import time
+
+from src.ingest_queue import DONE, FAILED, QUEUED, RUNNING, IngestQueue
+
+
+def _product(product_id):
+    return {"product_id": product_id, "product_time": "2025-01-01T05:30:00"}
+
+
+def test_claim_marks_jobs_running_once(tmp_path):
+    queue = IngestQueue(tmp_path / "queue.sqlite", lease_seconds=60)
+    queue.submit("aoi", _product("a"))
+    queue.submit("aoi", _product("b"))
+    queue.submit("aoi", _product("a"))
+
+    jobs = queue.claim(limit=10)
+
+    assert sorted(job["product"]["product_id"] for job in jobs) == ["a", "b"]
+    assert {job["area_id"] for job in jobs} == {"aoi"}
+    assert queue.claim(limit=10) == []
+    assert {job["status"] for job in queue.status(["a", "b"]).values()} == {RUNNING}
+
+
+def test_claim_requeues_jobs_with_expired_lease(tmp_path):
+    queue = IngestQueue(tmp_path / "queue.sqlite", lease_seconds=0.2)
+    queue.submit("aoi", _product("a"))
+    queue.submit("aoi", _product("b"))
+    assert len(queue.claim(limit=10)) == 2
+
+    time.sleep(0.3)
+    queue.renew_leases(["b"])
+
+    assert [job["product"]["product_id"] for job in queue.claim(limit=10)] == ["a"]
+
+
+def test_failed_jobs_are_queued_again_done_jobs_are_not(tmp_path):
+    queue = IngestQueue(tmp_path / "queue.sqlite", lease_seconds=60)
+    queue.submit("aoi", _product("a"))
+    queue.submit("aoi", _product("b"))
+    queue.claim(limit=10)
+    queue.complete("a")
+    queue.complete("b", error=RuntimeError("download failed"))
+
+    status = queue.status(["a", "b"])
+    assert status["a"]["status"] == DONE
+    assert status["b"] == {
+        "status": FAILED,
+        "error": "download failed",
+        "product": _product("b"),
+    }
+
+    queue.submit("aoi", _product("a"))
+    queue.submit("aoi", _product("b"))
+
+    status = queue.status(["a", "b"])
+    assert status["a"]["status"] == DONE
+    assert status["b"]["status"] == QUEUED
@@ -0,0 +1,52 @@
+import geopandas as gpd
+import pytest
+import shapely
+from src import merged_layers
+from src.merged_layers import MergedLayerCache
+
+
+@pytest.fixture
+def product_layers(monkeypatch):
+    """Reads of product layers, recorded, each product a detailed square"""
+    reads = []
+
+    def get_existing_geodataframe(product_id, file_type, bbox=None):
+        reads.append(product_id)
+        offset = int(product_id[-1])
+        square = shapely.box(offset, 0, offset + 1, 1).segmentize(0.01)
+        return gpd.GeoDataFrame(geometry=[square], crs="EPSG:4326")
+
+    monkeypatch.setattr(
+        merged_layers, "get_existing_geodataframe", get_existing_geodataframe
+    )
+    return reads
+
+
+def test_simplified_layers_are_stored_per_tolerance(tmp_path, product_layers):
+    cache = MergedLayerCache(tmp_path, max_memory_entries=4)
+    original = cache.get("aoi", "t0", "flood", ["p1"])
+    simplified = cache.get_simplified("aoi", "t0", "flood", ["p1"], tolerance=0.1)
+
+    assert shapely.get_num_coordinates(simplified.geometry.values).sum() < (
+        shapely.get_num_coordinates(original.geometry.values).sum()
+    )
+    assert len(list(tmp_path.glob("*.parquet"))) == 2
+
+    # After a restart the simplified layer is read from disk
+    restarted = MergedLayerCache(tmp_path, max_memory_entries=4)
+    restarted.get_geojson("aoi", "t0", "flood", ["p1"], tolerance=0.1)
+    assert product_layers == ["p1"]
+
+
+def test_layers_of_previous_products_are_removed(tmp_path, product_layers):
+    cache = MergedLayerCache(tmp_path, max_memory_entries=4)
+    cache.get_simplified("aoi", "t0", "flood", ["p1"], tolerance=0.1)
+    cache.get_simplified("aoi", "t0", "flood", ["p1"], tolerance=0.01)
+    assert len(list(tmp_path.glob("*.parquet"))) == 3
+
+    merged = cache.get("aoi", "t0", "flood", ["p1", "p2"])
+
+    assert len(merged) == 1
+    assert [path.name for path in tmp_path.glob("*.parquet")] == [
+        cache._path("aoi", "t0", "flood", ["p1", "p2"]).name
+    ]
@@ -0,0 +1,19 @@
+from src import hf_utils
+from src.ingest_queue import DONE, IngestQueue, IngestWorker
+from src.prefetch import Prefetcher
+
+
+def test_prefetch_ingests_new_products_once(tmp_path, local_dataset, gfm):
+    area_id = next(iter(gfm.retrieve_all_aois()))
+    ingest_queue = IngestQueue(tmp_path / "queue.sqlite", lease_seconds=60)
+    IngestWorker(ingest_queue, gfm, batch_size=10, poll_interval=0.1).start()
+    prefetcher = Prefetcher(gfm, ingest_queue, [area_id], lookback_days=2)
+
+    submitted = prefetcher.run_once()
+    statuses = prefetcher.wait_until_ingested(submitted, poll_interval=0.1)
+
+    assert submitted
+    assert {job["status"] for job in statuses.values()} == {DONE}
+    geojson_index = hf_utils.get_geojson_index()
+    assert all(product_id in geojson_index for product_id in submitted)
+    assert prefetcher.run_once() == []
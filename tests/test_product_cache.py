@@ -0,0 +1,126 @@
+import json
+import os
+import threading
+import time
+
+from src.metrics import MetricsRegistry
+from src.product_cache import PARSED_SIZE_FACTOR, ProductCache
+
+# A small geojson, sizes below are multiples of its length
+GEOJSON = json.dumps({"type": "FeatureCollection", "features": [], "pad": "x" * 51})
+GEOJSON_SIZE = len(GEOJSON)
+
+
+def _fetcher(fetched, content=GEOJSON):
+    def fetch(dest_path):
+        fetched.append(dest_path)
+        dest_path.write_text(content)
+
+    return fetch
+
+
+def test_get_parses_once_and_then_hits_memory(tmp_path):
+    cache = ProductCache(tmp_path, max_memory_bytes=10**6, max_disk_bytes=10**6)
+    fetched = []
+
+    first = cache.get("p1", "flood", _fetcher(fetched))
+    second = cache.get("p1", "flood", _fetcher(fetched))
+
+    assert first is second
+    assert len(fetched) == 1
+    stats = cache.stats()
+    assert (stats["misses"], stats["memory_hits"], stats["disk_hits"]) == (1, 1, 0)
+    assert stats["memory_bytes"] == GEOJSON_SIZE * PARSED_SIZE_FACTOR
+
+
+def test_memory_is_bounded_by_parsed_size_in_lru_order(tmp_path):
+    parsed_size = GEOJSON_SIZE * PARSED_SIZE_FACTOR
+    cache = ProductCache(
+        tmp_path, max_memory_bytes=2 * parsed_size, max_disk_bytes=10**6
+    )
+    fetched = []
+    cache.get("p1", "flood", _fetcher(fetched))
+    cache.get("p2", "flood", _fetcher(fetched))
+    cache.get("p1", "flood", _fetcher(fetched))
+    cache.get("p3", "flood", _fetcher(fetched))
+
+    stats = cache.stats()
+    assert stats["memory_entries"] == 2
+    assert stats["memory_evictions"] == 1
+
+    # p2 was the least recently used, it is read again from disk
+    cache.get("p2", "flood", _fetcher(fetched))
+    assert cache.stats()["disk_hits"] == 1
+    assert len(fetched) == 3
+
+
+def test_disk_is_bounded_evicting_least_recently_used(tmp_path):
+    cache = ProductCache(tmp_path, max_memory_bytes=0, max_disk_bytes=2 * GEOJSON_SIZE)
+    fetched = []
+    for product_id in ["p1", "p2"]:
+        cache.get(product_id, "flood", _fetcher(fetched))
+    # Mark p2 as older than p1, so it is evicted first
+    os.utime(tmp_path / "p2_flood.geojson", (time.time() - 60, time.time() - 60))
+    cache.get("p3", "flood", _fetcher(fetched))
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "p1_flood.geojson",
+        "p3_flood.geojson",
+    ]
+    assert cache.stats()["disk_bytes"] == 2 * GEOJSON_SIZE
+    assert cache.stats()["disk_evictions"] == 1
+
+
+def test_files_in_use_are_not_evicted(tmp_path):
+    cache = ProductCache(tmp_path, max_memory_bytes=0, max_disk_bytes=GEOJSON_SIZE)
+    fetched = []
+
+    def read_while_fetching_another(path):
+        # Over the disk limit, but both files are in use
+        cache.get("p2", "flood", _fetcher(fetched))
+        return path.read_text()
+
+    assert (
+        cache.read("p1", "flood", _fetcher(fetched), read_while_fetching_another)
+        == GEOJSON
+    )
+    assert cache.stats()["disk_evictions"] == 0
+
+    cache.get("p3", "flood", _fetcher(fetched))
+    assert cache.stats()["disk_evictions"] == 2
+    assert [path.name for path in tmp_path.iterdir()] == ["p3_flood.geojson"]
+
+
+def test_concurrent_misses_fetch_once(tmp_path):
+    cache = ProductCache(tmp_path, max_memory_bytes=0, max_disk_bytes=10**6)
+    fetched = []
+    fetch = _fetcher(fetched)
+
+    def slow_fetch(dest_path):
+        time.sleep(0.1)
+        fetch(dest_path)
+
+    threads = [
+        threading.Thread(target=cache.get, args=("p1", "flood", slow_fetch))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(fetched) == 1
+    assert cache.stats()["disk_bytes"] == GEOJSON_SIZE
+
+
+def test_stats_are_exported_to_prometheus(tmp_path):
+    cache = ProductCache(tmp_path, max_memory_bytes=10**6, max_disk_bytes=10**6)
+    cache.get("p1", "flood", _fetcher([]))
+    registry = MetricsRegistry()
+    registry.register_collector(cache.collect_metrics)
+
+    exported = registry.to_prometheus().splitlines()
+
+    assert "# TYPE floodmap_product_cache_misses_total counter" in exported
+    assert "floodmap_product_cache_misses_total 1" in exported
+    assert f"floodmap_product_cache_disk_bytes {GEOJSON_SIZE}" in exported
@@ -0,0 +1,51 @@
+from datetime import date
+
+from src.product_listing_cache import ProductListingCache
+
+
+def _interval(start, end):
+    return {"start": start, "end": end}
+
+
+def test_uncovered_ranges_without_intervals():
+    assert ProductListingCache._uncovered_ranges(
+        [], date(2025, 1, 1), date(2025, 1, 10)
+    ) == [(date(2025, 1, 1), date(2025, 1, 10))]
+
+
+def test_uncovered_ranges_around_and_between_intervals():
+    intervals = [
+        _interval(date(2025, 1, 6), date(2025, 1, 8)),
+        _interval(date(2025, 1, 2), date(2025, 1, 4)),
+    ]
+
+    assert ProductListingCache._uncovered_ranges(
+        intervals, date(2025, 1, 1), date(2025, 1, 10)
+    ) == [
+        (date(2025, 1, 1), date(2025, 1, 2)),
+        (date(2025, 1, 4), date(2025, 1, 6)),
+        (date(2025, 1, 8), date(2025, 1, 10)),
+    ]
+
+
+def test_uncovered_ranges_overlapping_intervals():
+    intervals = [
+        _interval(date(2024, 12, 1), date(2025, 1, 5)),
+        _interval(date(2025, 1, 3), date(2025, 1, 7)),
+        _interval(date(2025, 2, 1), date(2025, 3, 1)),
+    ]
+
+    assert ProductListingCache._uncovered_ranges(
+        intervals, date(2025, 1, 1), date(2025, 1, 10)
+    ) == [(date(2025, 1, 7), date(2025, 1, 10))]
+
+
+def test_uncovered_ranges_fully_covered():
+    intervals = [_interval(date(2025, 1, 1), date(2025, 1, 10))]
+
+    assert (
+        ProductListingCache._uncovered_ranges(
+            intervals, date(2025, 1, 2), date(2025, 1, 5)
+        )
+        == []
+    )
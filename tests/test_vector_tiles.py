@@ -0,0 +1,95 @@
+import shapely
+from src.config_parameters import params
+from src.vector_tiles import (
+    TILE_EXTENT,
+    TileServer,
+    encode_tile,
+    get_cached_tile_server,
+)
+
+
+def _read_varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, pos
+
+
+def _read_fields(data):
+    """Protobuf message as a list of (field number, value), bytes for length delimited"""
+    fields = []
+    pos = 0
+    while pos < len(data):
+        key, pos = _read_varint(data, pos)
+        number, wire_type = key >> 3, key & 0x7
+        if wire_type == 0:
+            value, pos = _read_varint(data, pos)
+        else:
+            assert wire_type == 2
+            length, pos = _read_varint(data, pos)
+            value, pos = data[pos : pos + length], pos + length
+        fields.append((number, value))
+    return fields
+
+
+def _read_packed_varints(data):
+    values = []
+    pos = 0
+    while pos < len(data):
+        value, pos = _read_varint(data, pos)
+        values.append(value)
+    return values
+
+
+def test_encode_tile_polygon_as_in_specification():
+    # The polygon example of the Mapbox Vector Tile specification, section 4.3.5
+    polygon = shapely.Polygon([(3, 6), (8, 12), (20, 34)])
+
+    tile = _read_fields(encode_tile({"flood": [polygon]}))
+
+    assert [number for number, _ in tile] == [3]
+    # Layer version, name and extent, besides the features
+    layer = {number: value for number, value in _read_fields(tile[0][1]) if number != 2}
+    assert layer == {15: 2, 1: b"flood", 5: TILE_EXTENT}
+    features = [value for number, value in _read_fields(tile[0][1]) if number == 2]
+    assert len(features) == 1
+    feature = dict(_read_fields(features[0]))
+    # Polygon type and its geometry commands
+    assert feature[3] == 3
+    assert _read_packed_varints(feature[4]) == [9, 6, 12, 18, 10, 12, 24, 44, 15]
+
+
+def test_encode_tile_orients_rings_and_skips_empty_geometries():
+    # Clockwise exterior with a hole, rings have to be reversed
+    square = shapely.Polygon(
+        [(0, 0), (0, 10), (10, 10), (10, 0)],
+        holes=[[(2, 2), (8, 2), (8, 8), (2, 8)]],
+    )
+
+    tile = _read_fields(encode_tile({"flood": [square, shapely.Polygon()]}))
+
+    features = [value for number, value in _read_fields(tile[0][1]) if number == 2]
+    assert len(features) == 1
+    commands = _read_packed_varints(dict(_read_fields(features[0]))[4])
+    # MoveTo, LineTo x3, ClosePath for each ring
+    assert commands[0] == 9 and commands[3] == 3 << 3 | 2 and commands[10] == 15
+    assert commands[11] == 9 and commands[14] == 3 << 3 | 2 and commands[21] == 15
+    assert len(commands) == 22
+
+
+def test_tile_server_is_none_when_the_port_is_taken(monkeypatch):
+    other_server = TileServer("127.0.0.1", 0)
+    host, port = other_server.httpd.server_address
+    assert host == "127.0.0.1"
+    monkeypatch.setitem(params, "vector_tiles_port", port)
+    get_cached_tile_server.clear()
+    try:
+        assert get_cached_tile_server() is None
+    finally:
+        get_cached_tile_server.clear()
+        other_server.httpd.shutdown()
+        other_server.httpd.server_close()